@@ -0,0 +1,58 @@
+# Benchmarks how recommendation throughput scales with the number of threads sharing one RecommenderModel, and checks that every
+# thread gets exactly the recommendations a single thread does. Most of the time of a call is spent in numpy kernels that release
+# the GIL (gathering the neighbours' ratings, the weighted sum, partitioning and sorting the scores), so throughput should grow with
+# threads up to the number of cores. Uses synthetic ratings with MovieLens-like sparsity, so no database connection is needed.
+# Run from the base directory with:
+# python -m benchmarks.benchmark_concurrent_serving
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy import sparse
+from recommendations import similarity
+from recommendations.id_encoding import IdEncoder
+from recommendations.popularity import PopularityIndex
+from recommendations.recommender_model import RecommenderModel
+
+NUMBER_OF_USERS = 3000
+NUMBER_OF_MOVIES = 9700
+DENSITY = 0.017 # share of (user, movie) pairs with a rating, as in the MovieLens dataset the recommender uses
+NUMBER_OF_NEIGHBOURS = 50
+NUMBER_OF_SIMILAR_USERS = 20
+NUMBER_OF_REQUESTS = 6000
+THREAD_COUNTS = (1, 2, 4, 8)
+
+def build_model():
+    rng = np.random.default_rng(0)
+    sparseRatings = sparse.random(NUMBER_OF_USERS, NUMBER_OF_MOVIES, density=DENSITY, format="csr", random_state=rng, data_rvs=lambda size: rng.integers(1, 11, size) / 2)
+    ratings = sparseRatings.toarray()
+    movieIds = IdEncoder(np.arange(NUMBER_OF_MOVIES))
+    neighbourPositions, neighbourScores = similarity.top_k_similar_users(sparseRatings, NUMBER_OF_NEIGHBOURS)
+    return RecommenderModel(IdEncoder(np.arange(NUMBER_OF_USERS)), movieIds, ratings, neighbourPositions=neighbourPositions, neighbourScores=neighbourScores, popularity=PopularityIndex.from_ratings(movieIds, ratings))
+
+def serve(model, userIds):
+    return [model.recommend(userId, True, n=10, numberOfSimilarUsers=NUMBER_OF_SIMILAR_USERS) for userId in userIds]
+
+def main():
+    model = build_model()
+    requests = np.random.default_rng(1).integers(0, NUMBER_OF_USERS, NUMBER_OF_REQUESTS).tolist()
+    expected = serve(model, requests)
+    print("Cores:", os.cpu_count(), "| model:", NUMBER_OF_USERS, "users x", NUMBER_OF_MOVIES, "movies |", NUMBER_OF_REQUESTS, "requests per run")
+    print()
+
+    print(f"{'threads':>8}{'requests/s':>14}{'speedup':>10}{'identical':>11}")
+    baseline = None
+    for threads in THREAD_COUNTS:
+        chunks = [requests[start::threads] for start in range(threads)]
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(serve, [model] * threads, chunks))
+            elapsed = time.perf_counter() - start
+
+        identical = all(results[thread] == expected[thread::threads] for thread in range(threads))
+        throughput = NUMBER_OF_REQUESTS / elapsed
+        baseline = throughput if baseline is None else baseline
+        print(f"{threads:>8}{throughput:>14.0f}{throughput / baseline:>10.2f}{str(identical):>11}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# Benchmarks the time and peak memory of building the top-k neighbour table with each similarity metric on sparse ratings,
+# against the previous dense cosine path (dense ratings, as build_recommender_model used before switching to CSR) and sklearn's cosine_similarity on the whole matrix.
+# Uses synthetic ratings with MovieLens-like sparsity, so no database connection is needed. Run from the base directory with:
+# python -m benchmarks.benchmark_similarity_metrics
+import time
+import tracemalloc
+import numpy as np
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+from recommendations import similarity
+from recommendations.similarity_metrics import SIMILARITY_METRICS
+
+NUMBER_OF_USERS = 3000
+NUMBER_OF_MOVIES = 9700
+DENSITY = 0.017 # share of (user, movie) pairs with a rating, as in the MovieLens dataset the recommender uses
+NUMBER_OF_NEIGHBOURS = 50
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    rng = np.random.default_rng(0)
+    sparseRatings = sparse.random(NUMBER_OF_USERS, NUMBER_OF_MOVIES, density=DENSITY, format="csr", random_state=rng, data_rvs=lambda size: rng.integers(1, 11, size) / 2)
+    denseRatings = sparseRatings.toarray()
+    print("Ratings:", NUMBER_OF_USERS, "users x", NUMBER_OF_MOVIES, "movies,", sparseRatings.nnz, "ratings")
+    print("(peak memory does not include the ratings themselves: dense", denseRatings.nbytes >> 20, "MiB, sparse", (sparseRatings.data.nbytes + sparseRatings.indices.nbytes + sparseRatings.indptr.nbytes) >> 20, "MiB)")
+    print()
+
+    cases = [
+        ("sklearn cosine_similarity, full matrix (original)", lambda: cosine_similarity(denseRatings)),
+        ("cosine, dense ratings (previous dense path)", lambda: similarity.top_k_similar_users(denseRatings, NUMBER_OF_NEIGHBOURS)),
+    ]
+    for metric in SIMILARITY_METRICS:
+        cases.append((metric + ", sparse ratings", lambda metric=metric: similarity.top_k_similar_users(sparseRatings, NUMBER_OF_NEIGHBOURS, metric=metric)))
+
+    print(f"{'':52}{'time (s)':>10}{'peak (MiB)':>12}")
+    for name, function in cases:
+        elapsed, peak = measure(function)
+        print(f"{name:52}{elapsed:>10.2f}{peak / 2 ** 20:>12.1f}")
+
+if __name__ == "__main__":
+    main()
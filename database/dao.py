@@ -1,3 +1,5 @@
+from collections import namedtuple
+import numpy as np
 from pymongo import MongoClient
 
 # Generally want to avoid hard-coding the connection string, however to avoid the user having to create their own account, a connection string for a default user was generated
@@ -9,6 +11,15 @@ def get_ratings_data():
     ratings_data = list(db["ratings"].find({}, {"_id": 0, "userId": 1, "movieId": 1, "rating": 1}))
     return ratings_data
 
+# returns the ratings whose 'field' is greater than 'after' (every rating if after is None), in increasing order of that field.
+# Used to poll for ratings added since the last poll: with the default field '_id' the high-water mark is the ObjectId of the last
+# rating seen, a timestamp field such as 'updatedAt' also picks up ratings that were changed rather than inserted.
+# Each rating is returned with 'field' included so the caller can take its new high-water mark from the last one
+def get_ratings_changed_since(after, field="_id", limit=0):
+    query = {} if after is None else {field: {"$gt": after}}
+    projection = {"_id": 1, "userId": 1, "movieId": 1, "rating": 1, field: 1}
+    return list(db["ratings"].find(query, projection).sort(field, 1).limit(limit))
+
 def get_movie_title_from_id(movieId):
     if not movieId or not isinstance(movieId, int):
         return None
@@ -24,7 +35,7 @@ def get_movie_title_from_id(movieId):
 def build_movie_genre_map():
     
     movieGenreMap = {}
-    movies = db["movies"].find({}, {"movieId":1, "genres":1})
+    movies = db["movies"].find({}, {"_id":0, "movieId":1, "genres":1})
 
     if movies is None:
         return None
@@ -32,4 +43,75 @@ def build_movie_genre_map():
     for movie in movies:
         movieGenreMap[movie["movieId"]] = movie["genres"]
 
-    return movieGenreMap
\ No newline at end of file
+    return movieGenreMap
+
+# Statistics API: aggregations run server-side as MongoDB pipelines, so only one small document per group comes back rather than every rating.
+# Results are cached together with a fingerprint of the collection they were computed from (see collection_fingerprint), and recomputed
+# the next time they are asked for after the fingerprint changes
+
+# ids: sorted numpy array of the movieIds (or userIds), counts / sums: number and sum of the ratings of each of them
+RatingStatistics = namedtuple("RatingStatistics", ["ids", "counts", "sums"])
+
+_statisticsCache = {} # statistic name -> (fingerprint, result)
+
+# returns the number of ratings and their sum for every movie that has been rated, i.e. popularity and (sums / counts) mean rating
+def get_movie_rating_statistics():
+    return _cached("movieRatingStatistics", "ratings", lambda: _rating_statistics("movieId"))
+
+# returns the number of ratings and their sum for every user who has rated a movie, i.e. activity and (sums / counts) mean rating
+def get_user_rating_statistics():
+    return _cached("userRatingStatistics", "ratings", lambda: _rating_statistics("userId"))
+
+# returns (genres, movieCounts): every genre that appears in the movies collection in sorted order, and how many movies have each of them
+def get_genre_vocabulary():
+    return _cached("genreVocabulary", "movies", _genre_vocabulary)
+
+UPDATE_MARKER_FIELD = "updatedAt" # timestamp writers set on every insert or update, as polled by a MongoChangeSource on that field
+
+# a cheap fingerprint of a collection's contents: its document count (from the collection metadata), its highest _id, which change
+# whenever a document is inserted or removed, and its latest UPDATE_MARKER_FIELD, which changes whenever a document is updated in place.
+# Each is a single index lookup given an index on UPDATE_MARKER_FIELD. Documents updated without setting UPDATE_MARKER_FIELD keep the
+# same fingerprint, call clear_statistics_cache after those
+def collection_fingerprint(collection):
+    newest = db[collection].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    lastUpdated = db[collection].find_one({UPDATE_MARKER_FIELD: {"$exists": True}}, {"_id": 0, UPDATE_MARKER_FIELD: 1}, sort=[(UPDATE_MARKER_FIELD, -1)])
+    return (
+        db[collection].estimated_document_count(),
+        None if newest is None else newest["_id"],
+        None if lastUpdated is None else lastUpdated[UPDATE_MARKER_FIELD]
+    )
+
+def clear_statistics_cache():
+    _statisticsCache.clear()
+
+def _cached(name, collection, compute):
+    fingerprint = collection_fingerprint(collection)
+    cached = _statisticsCache.get(name)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    result = compute()
+    _statisticsCache[name] = (fingerprint, result)
+    return result
+
+def _rating_statistics(field):
+    groups = list(db["ratings"].aggregate([
+        {"$group": {"_id": "$" + field, "count": {"$sum": 1}, "sum": {"$sum": "$rating"}}},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "id": "$_id", "count": 1, "sum": 1}},
+    ]))
+    return RatingStatistics(
+        np.array([group["id"] for group in groups]),
+        np.array([group["count"] for group in groups], dtype=np.int64),
+        np.array([group["sum"] for group in groups], dtype=np.float64)
+    )
+
+def _genre_vocabulary():
+    # genres are stored as one "Genre1|Genre2" string per movie, split them server-side and count the movies of each genre
+    groups = list(db["movies"].aggregate([
+        {"$project": {"_id": 0, "genre": {"$split": ["$genres", "|"]}}},
+        {"$unwind": "$genre"},
+        {"$group": {"_id": "$genre", "movieCount": {"$sum": 1}}},
+        {"$sort": {"_id": 1}},
+    ]))
+    return [group["_id"] for group in groups], np.array([group["movieCount"] for group in groups], dtype=np.int64)
\ No newline at end of file
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pds
+from database import dao
+from evaluator import evaluator
+from evaluator.sampled_evaluation import METRICS, left_out_movie_positions
+from recommendations import movie_recommendations
+from recommendations.recommender_model import score_movies, top_movie_positions, user_movie_scores
+from recommendations.similarity_metrics import DEFAULT_SIMILARITY_METRIC
+
+DEFAULT_CUTOFFS = (5, 10, 20, 50) # top N list lengths to report every metric at
+
+# Evaluates the recommender system at several top N list lengths (cutoffs) at once. Every user is scored a single time, keeping
+# their top max(cutoffs) movies, and the metrics at each cutoff N are then calculated from the first N movies of those lists.
+# Returns a metric x cutoff table, so the cost is one scoring pass no matter how many cutoffs are requested.
+# similarityMetric picks how user similarity is measured when the model has to be built, with a neighbour table wide enough for numberOfSimilarUsers
+def evaluate_at_cutoffs(cutoffs=DEFAULT_CUTOFFS, model=None, numberOfSimilarUsers=movie_recommendations.NUMBER_OF_SIMILAR_USERS, similarityMetric=DEFAULT_SIMILARITY_METRIC):
+    print("Evaluating Metrics for recommender system at cutoffs", list(cutoffs))
+    if model is None:
+        model = movie_recommendations.build_recommender_model(numberOfNeighbours=max(movie_recommendations.NUMBER_OF_NEIGHBOURS_TO_KEEP, numberOfSimilarUsers), metric=similarityMetric)
+    if model.similarity is None and model.neighbourPositions.shape[1] < min(numberOfSimilarUsers, len(model.userIds) - 1):
+        raise ValueError("the model's neighbour table is narrower than numberOfSimilarUsers")
+
+    leftOutMovies = left_out_movie_positions(evaluator.generateLOOCVTestData(), model.userIds, model.movieIds)
+    genreIndicator = build_genre_indicator(dao.build_movie_genre_map(), model.movieIds)
+    rankedForHitRate, ranked = ranked_recommendation_tables(model, max(cutoffs), numberOfSimilarUsers)
+
+    results = metrics_at_cutoffs(rankedForHitRate, ranked, leftOutMovies, genreIndicator, cutoffs)
+    print(results)
+    return results
+
+# scores every user once and returns two users x k tables of movie positions, best first, padded with -1 when a user has fewer
+# than k recommendations: the first includes already watched movies (for the hit rates), the second excludes them (for everything else)
+def ranked_recommendation_tables(model, k, numberOfSimilarUsers):
+    rankedForHitRate, ranked = ranked_tables_for_neighbour_counts(model, np.arange(len(model.userIds)), [numberOfSimilarUsers], k)
+    return rankedForHitRate[0], ranked[0]
+
+# same as ranked_recommendation_tables, but for several neighbour counts and only for the given users, returning
+# (neighbour counts x users x k) tables. A user's movie scores with n neighbours are their scores with fewer neighbours plus the
+# ratings of the extra neighbours, so each user is still scored once, adding neighbours from the model's sorted neighbour list.
+# Users are ranked as RecommenderModel.recommend ranks them (see recommender_model.user_movie_scores)
+def ranked_tables_for_neighbour_counts(model, userPositions, neighbourCounts, k):
+    neighbourCounts = list(neighbourCounts)
+    rankedForHitRate = np.full((len(neighbourCounts), len(userPositions), k), -1, dtype=np.int32)
+    ranked = np.full((len(neighbourCounts), len(userPositions), k), -1, dtype=np.int32)
+    countOrder = np.argsort(neighbourCounts, kind="stable")
+
+    for row, userPosition in enumerate(userPositions):
+        neighbourPositions, neighbourScores = model.similar_user_positions(userPosition, max(neighbourCounts))
+        watched = model.ratings[userPosition] > 0
+        scores, candidates = 0.0, False
+        scoredNeighbours = 0
+        for countIndex in countOrder:
+            numberOfSimilarUsers = min(neighbourCounts[countIndex], len(neighbourPositions))
+            if numberOfSimilarUsers > scoredNeighbours:
+                extraScores, extraCandidates = score_movies(model.ratings, neighbourPositions[scoredNeighbours:numberOfSimilarUsers], neighbourScores[scoredNeighbours:numberOfSimilarUsers])
+                scores, candidates = scores + extraScores, candidates | extraCandidates
+                scoredNeighbours = numberOfSimilarUsers
+
+            movieScores = user_movie_scores(model.ratings, userPosition, neighbourPositions[:numberOfSimilarUsers], neighbourScores[:numberOfSimilarUsers], model.popularity, (scores, candidates))
+            includingWatched = top_movie_positions(movieScores, k, None, model.popularity)
+            if includingWatched is None:
+                continue # no similar users and no popularity index to fall back to
+            excludingWatched = top_movie_positions(movieScores, k, watched, model.popularity)
+            rankedForHitRate[countIndex, row, :len(includingWatched)] = includingWatched
+            ranked[countIndex, row, :len(excludingWatched)] = excludingWatched
+
+    return rankedForHitRate, ranked
+
+# builds a (movies + 1) x genres count matrix from the movieId -> "Genre1|Genre2" map, where row p counts the genres of the movie at
+# position p. The extra last row is all zeros so that -1 padding in the ranked tables picks up no genres.
+# As in evaluator.calculateGiniSimpsonDiversity, a movie missing from the map counts as having the single genre ""
+def build_genre_indicator(movieGenreMap, movieIds):
+    if not movieGenreMap:
+        return None
+
+    genresOfMovie = [movieGenreMap.get(movieId, "").split("|") for movieId in movieIds.decode(range(len(movieIds)))]
+    genres = sorted({genre for movieGenres in genresOfMovie for genre in movieGenres})
+    genrePositions = {genre: position for position, genre in enumerate(genres)}
+
+    genreIndicator = np.zeros((len(movieIds) + 1, len(genres)))
+    for moviePosition, movieGenres in enumerate(genresOfMovie):
+        for genre in movieGenres:
+            genreIndicator[moviePosition, genrePositions[genre]] += 1
+    return genreIndicator
+
+# calculates every metric at every cutoff from the ranked tables, returning a metric x cutoff DataFrame.
+# Each metric has the same definition as in evaluator.py, applied to each user's first N recommendations
+def metrics_at_cutoffs(rankedForHitRate, ranked, leftOutMovies, genreIndicator, cutoffs):
+    cutoffs = sorted(cutoffs)
+    hitRanks = hit_ranks(rankedForHitRate, leftOutMovies)
+    hasLeftOut = leftOutMovies >= 0
+
+    results = {}
+    for cutoff in cutoffs:
+        prefix = ranked[:, :cutoff]
+        hits = hitRanks[hasLeftOut] < cutoff
+        results[cutoff] = [
+            hits.mean() if hits.size else 0.0,
+            np.where(hits, 1 / (hitRanks[hasLeftOut] + 1), 0.0).mean() if hits.size else 0.0,
+            len(np.unique(prefix[prefix >= 0])) / evaluator.TOTAL_NUMBER_OF_MOVIES,
+            _mean_over_users_with_recommendations(diversity_per_user(prefix, genreIndicator), prefix),
+            _mean_over_users_with_recommendations(novelty_per_user(prefix), prefix),
+        ]
+
+    return pds.DataFrame(results, index=METRICS)
+
+# 0-based rank of each user's left-out movie in their ranked list, or the list length (i.e. never within a cutoff) if it is not there
+def hit_ranks(rankedForHitRate, leftOutMovies):
+    matches = (rankedForHitRate == leftOutMovies[:, None]) & (leftOutMovies >= 0)[:, None]
+    return np.where(matches.any(axis=1), matches.argmax(axis=1), rankedForHitRate.shape[1])
+
+# Gini-Simpson diversity of the genres of every user's (prefix of) recommendations, nan for users with no recommendations
+def diversity_per_user(prefix, genreIndicator):
+    if genreIndicator is None:
+        return np.zeros(len(prefix)) # diversity is 0 without genre information, as in calculateAverageGiniSimpsonDiversityAcrossAllUsers
+
+    genreCounts = genreIndicator[prefix].sum(axis=1) # -1 padding selects the all zero last row
+    totalGenres = genreCounts.sum(axis=1)
+    sumOfSquares = (genreCounts ** 2).sum(axis=1)
+    return np.divide(totalGenres ** 2 - sumOfSquares, totalGenres ** 2, out=np.full(len(prefix), np.nan), where=totalGenres > 0)
+
+# average novelty log2(M/K) of every user's (prefix of) recommendations, where M is the number of users with recommendations
+# and K is how many users' prefixes each movie appears in, nan for users with no recommendations
+def novelty_per_user(prefix):
+    valid = prefix >= 0
+    usersWithRecommendations = valid[:, 0].sum() if prefix.shape[1] else 0
+    if usersWithRecommendations == 0:
+        return np.full(len(prefix), np.nan)
+
+    popularity = np.bincount(prefix[valid])
+    itemNovelty = np.zeros(prefix.shape)
+    itemNovelty[valid] = np.log2(usersWithRecommendations / popularity[prefix[valid]])
+    counts = valid.sum(axis=1)
+    return np.divide(itemNovelty.sum(axis=1), counts, out=np.full(len(prefix), np.nan), where=counts > 0)
+
+def _mean_over_users_with_recommendations(values, prefix):
+    values = values[prefix[:, 0] >= 0] if prefix.shape[1] else values[:0]
+    return values.mean() if values.size else 0.0
@@ -5,6 +5,7 @@ from surprise import Reader
 import math
 from database import dao
 from recommendations import movie_recommendations
+from recommendations.similarity_metrics import DEFAULT_SIMILARITY_METRIC
 
 TOTAL_NUMBER_OF_MOVIES = 9737 # the movies in the dataset are fixed so we can use a constant to define how many movies there are in total
 
@@ -12,28 +13,31 @@ TOTAL_NUMBER_OF_MOVIES = 9737 # the movies in the dataset are fixed so we can us
 # For more of an understanding on these metrics, these two articles are recommended:
 # https://www.evidentlyai.com/ranking-metrics/evaluating-recommender-systems#diversity
 # https://medium.com/nerd-for-tech/evaluating-recommender-systems-590a7b87afa5
-def evaluate():
+# similarityMetric picks how user similarity is measured (see similarity_metrics.SIMILARITY_METRICS)
+def evaluate(similarityMetric=DEFAULT_SIMILARITY_METRIC):
     print("Evaluating Metrics for recommender system")
     # for hit rate, we don't want to exclude already watched movies otherwise our hit rate would be 0 because then the recommended items list will never have one of the items the user has rated
-    recommendations_for_all_users_for_hit_rate = generate_recommendations_for_all_users(excludeAlreadyWatchedMovies=False)
+    recommendations_for_all_users_for_hit_rate = generate_recommendations_for_all_users(excludeAlreadyWatchedMovies=False, similarityMetric=similarityMetric)
     LOOCVTestData = generateLOOCVTestData()
     print("Hit rate: ", calculateHitRate(recommendations_for_all_users_for_hit_rate, LOOCVTestData))
     print("Average Reciprocal Hit rate: ", calculateAverageReciprocalHitRate(recommendations_for_all_users_for_hit_rate, LOOCVTestData))
 
     # for all other metrics, we can exclude already watched movies to make the recommendations resemble exactly what is shown to the user (where we exclude user's already watched movies)
-    recommendations_for_all_users = generate_recommendations_for_all_users(excludeAlreadyWatchedMovies=True)
+    recommendations_for_all_users = generate_recommendations_for_all_users(excludeAlreadyWatchedMovies=True, similarityMetric=similarityMetric)
     print("Coverage: ", (calculateCoverage(recommendations_for_all_users)*100), "%") # convert to a percentage
     print("Diversity: ", calculateAverageGiniSimpsonDiversityAcrossAllUsers(recommendations_for_all_users, dao.build_movie_genre_map()))
     print("Novelty: ",  calculateAverageNoveltyAcrossAllUsers(recommendations_for_all_users))
 
-def generate_recommendations_for_all_users(excludeAlreadyWatchedMovies):    
+def generate_recommendations_for_all_users(excludeAlreadyWatchedMovies, similarityMetric=DEFAULT_SIMILARITY_METRIC):    
     recommendation_map = {}  # This will store the userId to list of movieIds for user-movie recommendations
 
     user_item_matrix = movie_recommendations.build_user_item_matrix()
-    user_similarity = movie_recommendations.build_user_to_user_similarity_matrix(user_item_matrix)
+    user_similarity = movie_recommendations.build_user_to_user_similarity_matrix(user_item_matrix, metric=similarityMetric)
+    # the popularity fallback / prior is built once from the same ratings, as build_recommender_model does for the served model
+    popularityIndex = movie_recommendations.build_popularity_index(user_item_matrix)
     
     for userId in user_item_matrix.index:
-        userRecs = movie_recommendations.generate_recommendations(userId, excludeAlreadyWatchedMovies, user_item_matrix, user_similarity)
+        userRecs = movie_recommendations.generate_recommendations(userId, excludeAlreadyWatchedMovies, user_item_matrix, user_similarity, popularityIndex=popularityIndex)
         if userRecs:
             recommendation_map[userId] = userRecs
     
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pds
+from database import dao
+from evaluator import evaluator
+from recommendations import movie_recommendations, similarity
+from recommendations.popularity import PopularityIndex
+from recommendations.recommender_model import top_movie_positions, user_movie_scores
+from recommendations.similarity_metrics import DEFAULT_SIMILARITY_METRIC
+
+METRICS = ["Hit rate", "Average Reciprocal Hit rate", "Coverage", "Diversity", "Novelty"]
+
+# Evaluates the recommender system on a sample of users rather than every user, for quick directional numbers while tuning.
+# Users are split into numberOfStrata groups by how many movies they have rated (their activity level) and sampled
+# proportionally from each group with a fixed seed, so the same arguments always give the same sample.
+# Each metric is reported with a bootstrap confidence interval. If targetIntervalWidth is given (one width for every metric,
+# or a {metric: width} map), sampleSize more users are added at a time until every interval is at most that wide,
+# or maxSampleSize / every user has been reached.
+# Only the similarity rows of the sampled users are computed, so the cost grows with the sample rather than with users x users.
+# Note coverage is the share of all movies recommended to the sampled users, so it grows with the sample size.
+# similarityMetric picks how user similarity is measured (see similarity_metrics.SIMILARITY_METRICS)
+def evaluate_sampled(sampleSize=100, seed=1, numberOfStrata=4, confidenceLevel=0.95, numberOfBootstrapSamples=1000, targetIntervalWidth=None, maxSampleSize=None, similarityMetric=DEFAULT_SIMILARITY_METRIC):
+    print("Evaluating Metrics for recommender system on a sample of users")
+    userIds, movieIds, ratingsArray = movie_recommendations.build_rating_arrays(dao.get_ratings_data())
+    leftOutMovies = left_out_movie_positions(evaluator.generateLOOCVTestData(), userIds, movieIds)
+    movieGenres = movie_genres_by_position(dao.build_movie_genre_map(), movieIds)
+    popularityIndex = PopularityIndex.from_ratings(movieIds, ratingsArray)
+
+    strata = activity_strata(ratingsArray, numberOfStrata)
+    rng = np.random.default_rng(seed)
+    sampleOrder = stratified_sample_order(strata, rng)
+    maxSampleSize = len(userIds) if maxSampleSize is None else min(maxSampleSize, len(userIds))
+
+    userMetrics = {} # user position -> that user's per-user metrics, so users already scored are not scored again as the sample grows
+    currentSampleSize = min(sampleSize, maxSampleSize)
+    while True:
+        sample = stratified_sample(sampleOrder, strata, currentSampleSize)
+        newUsers = np.array([user for user in sample if user not in userMetrics], dtype=np.int64)
+        userMetrics.update(score_sampled_users(ratingsArray, newUsers, leftOutMovies, movieGenres, similarityMetric, popularityIndex))
+
+        results = confidence_intervals(sample, strata, userMetrics, confidenceLevel, numberOfBootstrapSamples, rng)
+        if targetIntervalWidth is None or currentSampleSize >= maxSampleSize or _intervals_within_target(results, targetIntervalWidth):
+            break
+        currentSampleSize = min(currentSampleSize + sampleSize, maxSampleSize)
+
+    print("Sampled users: ", len(sample), "of", len(userIds))
+    for metric, row in results.iterrows():
+        print(metric + ": ", row["estimate"], "(" + str(int(confidenceLevel * 100)) + "% CI", row["lower"], "-", row["upper"], ")")
+    return results
+
+# groups users into numberOfStrata activity levels by the number of movies they have rated, using quantiles so each level holds
+# a similar number of users. Returns the stratum of every user position
+def activity_strata(ratingsArray, numberOfStrata):
+    activity = (ratingsArray > 0).sum(axis=1)
+    boundaries = np.quantile(activity, np.linspace(0, 1, numberOfStrata + 1)[1:-1])
+    return np.searchsorted(boundaries, activity, side="right")
+
+# shuffles the users of each stratum once, a sample of any size is then the first users of each stratum's order.
+# This means a larger sample always contains the smaller one, which is what lets the sample grow progressively
+def stratified_sample_order(strata, rng):
+    return {stratum: rng.permutation(np.flatnonzero(strata == stratum)) for stratum in np.unique(strata)}
+
+# takes sampleSize users split across the strata in proportion to each stratum's share of all users
+def stratified_sample(sampleOrder, strata, sampleSize):
+    sizes = {stratum: len(order) for stratum, order in sampleOrder.items()}
+    allocation = {stratum: int(np.floor(sampleSize * size / len(strata))) for stratum, size in sizes.items()}
+
+    # hand out the places lost to rounding down to the strata with the largest remainders
+    remainders = sorted(sizes, key=lambda stratum: (sampleSize * sizes[stratum] / len(strata)) - allocation[stratum], reverse=True)
+    for stratum in remainders[:sampleSize - sum(allocation.values())]:
+        allocation[stratum] += 1
+
+    return np.concatenate([sampleOrder[stratum][:min(allocation[stratum], sizes[stratum])] for stratum in sampleOrder])
+
+# maps the LOOCV left-out (userId, movieId, rating) entries to an array holding the left-out movie position of every user position (-1 if none)
+def left_out_movie_positions(LOOCVTestData, userIds, movieIds):
+    leftOutMovies = np.full(len(userIds), -1, dtype=np.int64)
+    for leftOut in LOOCVTestData:
+        try:
+            userPosition = userIds.encode(int(leftOut[0]))
+            moviePosition = movieIds.encode(int(leftOut[1]))
+        except ValueError:
+            continue
+        if userPosition >= 0:
+            leftOutMovies[userPosition] = moviePosition
+    return leftOutMovies
+
+# scores the given users and returns {user position: (hit, reciprocal hit, recommended movie positions, diversity)}.
+# Recommendations include watched movies for the hit metrics and exclude them for the others, exactly as in evaluator.evaluate,
+# but both lists come from the same movie scores. If popularity is given, users with only a few ratings have their scores blended with it,
+# and users with no similar users get its ranking, as from RecommenderModel.recommend
+def score_sampled_users(ratingsArray, userPositions, leftOutMovies, movieGenres, similarityMetric=DEFAULT_SIMILARITY_METRIC, popularity=None):
+    if len(userPositions) == 0:
+        return {}
+
+    neighbourPositions, neighbourScores = similarity.top_k_similar_users(ratingsArray, movie_recommendations.NUMBER_OF_SIMILAR_USERS, userPositions=userPositions, metric=similarityMetric)
+    n = movie_recommendations.NUMBER_OF_MOVIES_TO_RETURN
+
+    userMetrics = {}
+    for row, userPosition in enumerate(userPositions):
+        recommendedForHitRate = np.empty(0, dtype=np.int32)
+        recommended = np.empty(0, dtype=np.int32)
+        movieScores = user_movie_scores(ratingsArray, userPosition, neighbourPositions[row], neighbourScores[row], popularity)
+        if movieScores is not None or popularity is not None:
+            recommendedForHitRate = top_movie_positions(movieScores, n, None, popularity)
+            recommended = top_movie_positions(movieScores, n, ratingsArray[userPosition] > 0, popularity)
+
+        hit, reciprocalHit = np.nan, np.nan # users with no left-out rating do not count towards the hit rates
+        if leftOutMovies[userPosition] >= 0:
+            ranks = np.flatnonzero(recommendedForHitRate == leftOutMovies[userPosition])
+            hit = 1.0 if len(ranks) else 0.0
+            reciprocalHit = 1 / (ranks[0] + 1) if len(ranks) else 0.0
+
+        diversity = evaluator.calculateGiniSimpsonDiversity(recommended.tolist(), movieGenres) if len(recommended) else np.nan
+        userMetrics[int(userPosition)] = (hit, reciprocalHit, recommended, diversity)
+
+    return userMetrics
+
+# returns a table of metric -> (estimate, lower, upper) for the sampled users.
+# Hit rates, diversity and novelty are per-user averages, weighted by each stratum's share of all users, and the bootstrap
+# resamples users within each stratum. Coverage is recomputed from the movies recommended to each bootstrap sample of users
+def confidence_intervals(sample, strata, userMetrics, confidenceLevel, numberOfBootstrapSamples, rng):
+    hits = np.array([userMetrics[user][0] for user in sample])
+    reciprocalHits = np.array([userMetrics[user][1] for user in sample])
+    diversity = np.array([userMetrics[user][3] for user in sample])
+    recommendations = [userMetrics[user][2] for user in sample]
+    novelty = _novelty_per_user(recommendations)
+
+    # movies recommended to each sampled user, as a users x (movies recommended to anyone in the sample) indicator matrix
+    recommendedMovies, columns = np.unique(np.concatenate(recommendations + [np.empty(0, dtype=np.int32)]), return_inverse=True)
+    indicator = np.zeros((len(sample), len(recommendedMovies)))
+    indicator[np.repeat(np.arange(len(sample)), [len(movies) for movies in recommendations]), columns] = 1
+
+    sampleStrata = strata[sample]
+    stratumWeights = {stratum: np.mean(strata == stratum) for stratum in np.unique(sampleStrata)}
+    members = {stratum: np.flatnonzero(sampleStrata == stratum) for stratum in stratumWeights}
+
+    # users are drawn with replacement within each stratum. A stratum with a single sampled user would always redraw that same
+    # user and show no variation at all, so such users are pooled and drawn from together instead
+    groups = [users for users in members.values() if len(users) > 1]
+    pooled = np.concatenate([users for users in members.values() if len(users) == 1] + [np.empty(0, dtype=np.int64)])
+    if len(pooled):
+        groups.append(pooled)
+
+    # one row per bootstrap sample, holding the indexes (into the sample) of the users drawn
+    draws = np.concatenate([users[rng.integers(0, len(users), (numberOfBootstrapSamples, len(users)))] for users in groups], axis=1)
+    drawCounts = np.zeros((numberOfBootstrapSamples, len(sample)))
+    np.add.at(drawCounts, (np.arange(numberOfBootstrapSamples)[:, None], draws), 1)
+
+    estimates = {}
+    bootstrapped = {}
+    for metric, values in (("Hit rate", hits), ("Average Reciprocal Hit rate", reciprocalHits), ("Diversity", diversity), ("Novelty", novelty)):
+        estimates[metric] = _stratified_mean(values, np.ones((1, len(sample))), members, stratumWeights)[0]
+        bootstrapped[metric] = _stratified_mean(values, drawCounts, members, stratumWeights)
+    estimates["Coverage"] = len(recommendedMovies) / evaluator.TOTAL_NUMBER_OF_MOVIES
+    bootstrapped["Coverage"] = ((drawCounts @ indicator) > 0).sum(axis=1) / evaluator.TOTAL_NUMBER_OF_MOVIES
+
+    alpha = (1 - confidenceLevel) / 2
+    rows = [[estimates[metric], *np.nanquantile(bootstrapped[metric], [alpha, 1 - alpha])] if not np.isnan(estimates[metric]) else [np.nan] * 3 for metric in METRICS]
+    return pds.DataFrame(rows, index=METRICS, columns=["estimate", "lower", "upper"])
+
+# per-user average novelty log2(M/K), where M is the number of sampled users with recommendations and K is how many of them each movie was recommended to
+def _novelty_per_user(recommendations):
+    usersWithRecommendations = sum(1 for movies in recommendations if len(movies))
+    if usersWithRecommendations == 0:
+        return np.full(len(recommendations), np.nan)
+
+    allRecommended = np.concatenate(recommendations)
+    popularity = dict(zip(*np.unique(allRecommended, return_counts=True)))
+    return np.array([np.mean([np.log2(usersWithRecommendations / popularity[movie]) for movie in movies]) if len(movies) else np.nan for movies in recommendations])
+
+# weighted mean of the per-user values for each row of counts (how many times each sampled user is counted), where users
+# with no value (nan) are left out and each stratum contributes in proportion to its share of all users
+def _stratified_mean(values, counts, members, stratumWeights):
+    valid = ~np.isnan(values)
+    filledValues = np.where(valid, values, 0.0)
+
+    weightedSum = np.zeros(len(counts))
+    totalWeight = np.zeros(len(counts))
+    for stratum, users in members.items():
+        stratumCounts = counts[:, users] * valid[users]
+        stratumTotals = stratumCounts.sum(axis=1)
+        stratumMeans = np.divide(stratumCounts @ filledValues[users], stratumTotals, out=np.zeros(len(counts)), where=stratumTotals > 0)
+        weightedSum += stratumWeights[stratum] * stratumMeans
+        totalWeight += np.where(stratumTotals > 0, stratumWeights[stratum], 0.0) # strata with no valid users are left out of the average
+
+    return np.divide(weightedSum, totalWeight, out=np.full(len(counts), np.nan), where=totalWeight > 0)
+
+def _intervals_within_target(results, targetIntervalWidth):
+    widths = results["upper"] - results["lower"]
+    if isinstance(targetIntervalWidth, dict):
+        return all(widths[metric] <= width for metric, width in targetIntervalWidth.items() if not np.isnan(widths[metric]))
+    return bool((widths.dropna() <= targetIntervalWidth).all())
+
+# re-keys the movieId -> genres map by movie position, so diversity can be calculated straight from recommended movie positions
+def movie_genres_by_position(movieGenreMap, movieIds):
+    if not movieGenreMap:
+        return {}
+    positions = movieIds.encode_many(list(movieGenreMap.keys()))
+    return {int(position): genres for position, genres in zip(positions, movieGenreMap.values()) if position >= 0}
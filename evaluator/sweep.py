@@ -0,0 +1,71 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pds
+from database import dao
+from evaluator import evaluator
+from evaluator.cutoff_metrics import build_genre_indicator, metrics_at_cutoffs, ranked_tables_for_neighbour_counts
+from evaluator.sampled_evaluation import left_out_movie_positions
+from recommendations import movie_recommendations
+from recommendations.similarity_metrics import DEFAULT_SIMILARITY_METRIC
+
+DEFAULT_NEIGHBOUR_COUNTS = (5, 10, 20, 50)
+DEFAULT_LIST_LENGTHS = (5, 10, 20)
+
+_workerModel = None # the model each pool worker scores with, set once per worker by _initialise_worker
+
+# Evaluates every combination of (number of similar users, top N list length, exclude already watched movies) and returns one
+# table with a row per configuration and a column per metric.
+# The model and its sorted neighbour table are built once, with enough neighbours for the largest neighbour count. Every user is then
+# scored a single time for all neighbour counts together (see cutoff_metrics.ranked_tables_for_neighbour_counts), and every
+# configuration's metrics are read from prefixes of those ranked lists, so a sweep costs about as much as one evaluation.
+# Scoring is split across a pool of 'processes' worker processes (None uses every core, 1 scores in this process).
+# As in evaluator.evaluate, the hit rates always come from lists that include already watched movies, excludeAlreadyWatchedMovies
+# applies to the lists that coverage, diversity and novelty are calculated from. similarityMetric is used when the model has to be built
+def run_sweep(neighbourCounts=DEFAULT_NEIGHBOUR_COUNTS, listLengths=DEFAULT_LIST_LENGTHS, excludeAlreadyWatchedMoviesOptions=(True, False), processes=None, model=None, similarityMetric=DEFAULT_SIMILARITY_METRIC):
+    print("Running hyperparameter sweep over", len(neighbourCounts) * len(listLengths) * len(excludeAlreadyWatchedMoviesOptions), "configurations")
+    if model is None:
+        model = movie_recommendations.build_recommender_model(numberOfNeighbours=max(neighbourCounts), metric=similarityMetric)
+    if model.similarity is None and model.neighbourPositions.shape[1] < min(max(neighbourCounts), len(model.userIds) - 1):
+        raise ValueError("the model's neighbour table is narrower than the largest neighbour count in the sweep")
+
+    leftOutMovies = left_out_movie_positions(evaluator.generateLOOCVTestData(), model.userIds, model.movieIds)
+    genreIndicator = build_genre_indicator(dao.build_movie_genre_map(), model.movieIds)
+    rankedForHitRate, ranked = score_all_users(model, neighbourCounts, max(listLengths), processes)
+
+    rows = {}
+    for countIndex, numberOfSimilarUsers in enumerate(neighbourCounts):
+        for excludeAlreadyWatchedMovies in excludeAlreadyWatchedMoviesOptions:
+            rankedForOtherMetrics = ranked[countIndex] if excludeAlreadyWatchedMovies else rankedForHitRate[countIndex]
+            results = metrics_at_cutoffs(rankedForHitRate[countIndex], rankedForOtherMetrics, leftOutMovies, genreIndicator, listLengths)
+            for n in listLengths:
+                rows[(numberOfSimilarUsers, n, excludeAlreadyWatchedMovies)] = results[n]
+
+    results = pds.DataFrame.from_dict(rows, orient="index")
+    results.index = pds.MultiIndex.from_tuples(results.index, names=["numberOfSimilarUsers", "n", "excludeAlreadyWatchedMovies"])
+    results = results.sort_index()
+    print(results)
+    return results
+
+# returns (neighbour counts x users x k) ranked tables for every user, scoring chunks of users in parallel worker processes
+def score_all_users(model, neighbourCounts, k, processes=None):
+    workers = processes or os.cpu_count() or 1
+    userChunks = [chunk for chunk in np.array_split(np.arange(len(model.userIds)), 4 * workers) if len(chunk)] # a few chunks per worker to even out the load
+    if workers == 1:
+        tables = [ranked_tables_for_neighbour_counts(model, chunk, neighbourCounts, k) for chunk in userChunks]
+    else:
+        # the model is sent to each worker once when it starts, rather than with every chunk of users
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initialise_worker, initargs=(model,)) as pool:
+            tables = list(pool.map(_score_chunk, userChunks, itertools.repeat(list(neighbourCounts)), itertools.repeat(k)))
+
+    rankedForHitRate = np.concatenate([table[0] for table in tables], axis=1)
+    ranked = np.concatenate([table[1] for table in tables], axis=1)
+    return rankedForHitRate, ranked
+
+def _initialise_worker(model):
+    global _workerModel
+    _workerModel = model
+
+def _score_chunk(userPositions, neighbourCounts, k):
+    return ranked_tables_for_neighbour_counts(_workerModel, userPositions, neighbourCounts, k)
@@ -1,4 +1,5 @@
 from recommendations import movie_recommendations
+from recommendations import recommendation_store
 from database import dao
 from evaluator import evaluator
 
@@ -7,7 +8,12 @@ from evaluator import evaluator
 USER_ID = 1
 
 print("Top 10 Recommendations for User with ID", USER_ID)
-movieRecommendations = movie_recommendations.generate_recommendations(USER_ID, excludeAlreadyWatchedMovies=True, user_similarity=None, user_item_matrix=None)
+# serve the precomputed recommendations if the store has been built (python -m recommendations.recommendation_store), otherwise compute them
+movieRecommendations = None
+if recommendation_store.store_exists():
+    movieRecommendations = recommendation_store.RecommendationStore().lookup(USER_ID, excludeAlreadyWatchedMovies=True)
+if movieRecommendations is None:
+    movieRecommendations = movie_recommendations.generate_recommendations(USER_ID, excludeAlreadyWatchedMovies=True, user_similarity=None, user_item_matrix=None)
 
 rank = 1
 for movieId in movieRecommendations:
@@ -0,0 +1,88 @@
+import numpy as np
+
+# Maps external ids (the userIds and movieIds stored in the database) to contiguous int32 positions 0..n-1 and back again.
+# Positions are what all of the internal numpy computation runs on, the external ids are only used at the API boundary.
+# Ids are kept in a sorted array, so encoding an id is a binary search (np.searchsorted) rather than a hashed pandas label lookup
+class IdEncoder:
+
+    def __init__(self, ids, isSorted=None):
+        self.ids = read_only(ids) # external id stored at each position, i.e. ids[position] -> external id
+        if self.ids.ndim != 1:
+            raise ValueError("ids must be one-dimensional")
+
+        if isSorted is None:
+            isSorted = len(self.ids) < 2 or bool((self.ids[1:] > self.ids[:-1]).all())
+
+        # if the ids are not already in strictly increasing order, keep a sorted copy along with the position each sorted id came from
+        if isSorted:
+            self._sortedIds = self.ids
+            self._sortedPositions = None
+        else:
+            self._sortedPositions = read_only(np.argsort(self.ids, kind="stable").astype(np.int32))
+            self._sortedIds = read_only(self.ids[self._sortedPositions])
+
+    # unpickling gives writable copies of the arrays
+    def __setstate__(self, state):
+        self.__dict__.update({name: read_only(value) if isinstance(value, np.ndarray) else value for name, value in state.items()})
+
+    # builds an encoder from a column of (possibly repeated) ids, e.g. the userId of every rating
+    @classmethod
+    def fit(cls, values):
+        return cls(np.unique(np.asarray(values)), isSorted=True)
+
+    # builds an encoder whose positions line up with the rows (or columns) of an existing pandas index
+    @classmethod
+    def from_index(cls, index):
+        # pandas caches these flags on the index, so wrapping the same index repeatedly does not rescan it
+        return cls(index.to_numpy(), isSorted=index.is_monotonic_increasing and index.is_unique)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, externalId):
+        return self.encode(externalId) >= 0
+
+    # returns the position of a single external id, or -1 if the id is unknown
+    def encode(self, externalId):
+        if len(self._sortedIds) == 0:
+            return -1
+        try:
+            sortedPosition = int(np.searchsorted(self._sortedIds, externalId))
+        except (TypeError, ValueError):
+            return -1 # id of a type that cannot be compared with the known ids, so it cannot be one of them
+
+        if sortedPosition >= len(self._sortedIds) or self._sortedIds[sortedPosition] != externalId:
+            return -1
+
+        return sortedPosition if self._sortedPositions is None else int(self._sortedPositions[sortedPosition])
+
+    # vectorised version of encode, returns an int32 array of positions with -1 for unknown ids
+    def encode_many(self, externalIds):
+        externalIds = np.asarray(externalIds)
+        positions = np.full(externalIds.shape, -1, dtype=np.int32)
+        if len(self._sortedIds) == 0 or externalIds.size == 0:
+            return positions
+
+        sortedPositions = np.searchsorted(self._sortedIds, externalIds)
+        inBounds = sortedPositions < len(self._sortedIds)
+        found = np.zeros(externalIds.shape, dtype=bool)
+        found[inBounds] = self._sortedIds[sortedPositions[inBounds]] == externalIds[inBounds]
+
+        if self._sortedPositions is None:
+            positions[found] = sortedPositions[found]
+        else:
+            positions[found] = self._sortedPositions[sortedPositions[found]]
+        return positions
+
+    # translates positions back to a list of external ids (as plain python values, e.g. int rather than numpy.int64)
+    def decode(self, positions):
+        return self.ids[np.asarray(positions, dtype=np.intp)].tolist()
+
+# returns a read-only view of an array, so whatever holds the view can never write to it (and can be shared between threads without
+# locking), while the array it was made from keeps its own flags. Used for every array held by IdEncoder, PopularityIndex and RecommenderModel
+def read_only(array):
+    if array is None:
+        return None
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
@@ -0,0 +1,253 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from scipy import sparse
+from database import dao
+from recommendations import movie_recommendations, similarity
+from recommendations.id_encoding import IdEncoder
+from recommendations.popularity import PopularityIndex
+from recommendations.recommender_model import RecommenderModel
+from recommendations.similarity_metrics import DEFAULT_SIMILARITY_METRIC
+
+DEFAULT_POLL_INTERVAL_SECONDS = 60
+
+# metrics where the similarity of two users only depends on those two users' ratings, so a change in some users' ratings can only
+# change the similarity rows of those users and the neighbour lists they are (or become) part of. Any other metric is fully rebuilt
+INCREMENTAL_METRICS = ("cosine", "pearson", "jaccard", "shrunk_cosine")
+
+# the model being served, along with its version (1 for the first model, +1 for every swap) and the time.time() it was swapped in
+ModelVersion = namedtuple("ModelVersion", ["model", "version", "builtAt"])
+
+# Change sources are polled for the ratings added (or changed) since the previous poll. poll() returns a list of
+# {"userId", "movieId", "rating"} dicts, the first poll returns every rating so the initial model and later updates come from one place.
+
+# polls the MongoDB ratings collection using a high-water mark on 'field': the ObjectId of the last rating seen by default, or a
+# timestamp field the writers maintain (e.g. 'updatedAt') to also pick up re-rated movies.
+# ObjectIds created by different clients in the same second are not strictly ordered, so a rating inserted concurrently with a poll
+# can be missed by an '_id' mark, a timestamp written by the database avoids that
+class MongoChangeSource:
+
+    def __init__(self, field="_id", batchSize=0):
+        self.field = field
+        self.batchSize = batchSize # maximum number of ratings returned per poll, 0 for no limit
+        self.highWaterMark = None
+
+    def poll(self):
+        changes = dao.get_ratings_changed_since(self.highWaterMark, self.field, self.batchSize)
+        if changes:
+            self.highWaterMark = changes[-1][self.field]
+        return [{"userId": change["userId"], "movieId": change["movieId"], "rating": change["rating"]} for change in changes]
+
+# local stand-in for the database when developing or testing: an append-only file with one JSON rating per line.
+# The byte offset read up to is the high-water mark, and a line is only read once it is complete (ends with a newline),
+# so a writer appending concurrently is never seen half written
+class EventLogChangeSource:
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+
+    def poll(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "rb") as eventLog:
+            eventLog.seek(self.offset)
+            data = eventLog.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        self.offset += len(complete)
+        return [json.loads(line) for line in complete.splitlines() if line.strip()]
+
+    # appends ratings to the log, each one written with a single write so it lands as a whole line
+    def append(self, ratings):
+        with open(self.path, "a") as eventLog:
+            for rating in ratings:
+                eventLog.write(json.dumps(rating) + "\n")
+
+# Keeps a recommender model up to date with a change source in a background thread, while requests keep being served.
+# Every refresh builds a new (shadow) model from copies of the served model's arrays, the served model is never written to.
+# Once the shadow model is complete it is swapped in with a single assignment of a ModelVersion, so a request that reads
+# current() (or model) once gets a model, its version and build time that all belong together, never a half updated model.
+# Requests that started on the old model finish on it, it is freed once nothing references it any more.
+# A change is a user's current rating of a movie, it replaces any earlier rating of that movie by that user (0 removes the rating).
+# When only existing users and movies are rated and the metric is one of INCREMENTAL_METRICS, only the neighbour lists that can
+# have changed are recomputed, otherwise (or with fullRebuild=True) the shadow model's similarity is rebuilt from scratch.
+# With publishPopularity=True every swapped in model's users and popularity index are also published to
+# movie_recommendations.publish_popularity_index, so generate_recommendations serves unknown users from them
+class ModelManager:
+
+    def __init__(self, changeSource, pollIntervalSeconds=DEFAULT_POLL_INTERVAL_SECONDS, numberOfNeighbours=movie_recommendations.NUMBER_OF_NEIGHBOURS_TO_KEEP, dtype=np.float64, memoryBudgetBytes=similarity.DEFAULT_MEMORY_BUDGET_BYTES, metric=DEFAULT_SIMILARITY_METRIC, fullRebuild=False, publishPopularity=False):
+        self.changeSource = changeSource
+        self.pollIntervalSeconds = pollIntervalSeconds
+        self.numberOfNeighbours = numberOfNeighbours
+        self.dtype = dtype
+        self.memoryBudgetBytes = memoryBudgetBytes
+        self.metric = metric
+        self.fullRebuild = fullRebuild
+        self.publishPopularity = publishPopularity
+
+        self.lastError = None # the exception of the last failed refresh, None once a refresh succeeds
+        self.pendingChanges = [] # changes polled but not yet in the served model, kept if building the shadow model fails
+        self._current = ModelVersion(None, 0, None)
+        self._upToDateAt = None # time of the last poll whose changes are all in the served model
+        self._refreshLock = threading.Lock() # one refresh at a time, whether from the background thread or a refresh() call
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # returns the ModelVersion being served, read it once per request and use its model for the whole request
+    def current(self):
+        return self._current
+
+    @property
+    def model(self):
+        return self._current.model
+
+    @property
+    def version(self):
+        return self._current.version
+
+    # seconds since the change source was last polled with every change it returned already in the served model,
+    # i.e. an upper bound on how old the newest rating the model can be missing is. None before the first model is built
+    def staleness(self):
+        if self._upToDateAt is None:
+            return None
+        return time.time() - self._upToDateAt
+
+    # returns the top n movieIds for a user from the served model, or None if there is no model yet. Users unknown to the model, or with
+    # no similar users, get the model's popularity ranking
+    def recommend(self, userId, excludeAlreadyWatchedMovies, n=None, numberOfSimilarUsers=None):
+        model = self._current.model
+        if model is None:
+            return None
+        return model.recommend(
+            userId,
+            excludeAlreadyWatchedMovies,
+            n=movie_recommendations.NUMBER_OF_MOVIES_TO_RETURN if n is None else n,
+            numberOfSimilarUsers=movie_recommendations.NUMBER_OF_SIMILAR_USERS if numberOfSimilarUsers is None else numberOfSimilarUsers
+        )
+
+    # builds the first model synchronously (so there is a model to serve as soon as this returns) and then starts polling
+    def start(self):
+        self.refresh()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._poll_until_stopped, name="model-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # polls the change source once and, if anything changed, builds and swaps in a new model. Returns True if a new model was swapped in
+    def refresh(self):
+        with self._refreshLock:
+            polledAt = time.time()
+            self.pendingChanges.extend(self.changeSource.poll())
+            current = self._current
+            if not self.pendingChanges:
+                if current.model is not None:
+                    self._upToDateAt = polledAt
+                return False
+
+            model = self._build_shadow_model(current.model, self.pendingChanges)
+            self.pendingChanges = []
+            if model is None:
+                return False
+            self._current = ModelVersion(model, current.version + 1, time.time()) # the swap
+            self._upToDateAt = polledAt
+            if self.publishPopularity:
+                movie_recommendations.publish_popularity_index(model.userIds, model.popularity)
+            return True
+
+    def _poll_until_stopped(self):
+        while not self._stopped.wait(self.pollIntervalSeconds):
+            try:
+                self.refresh()
+                self.lastError = None
+            except Exception as error:
+                # keep serving the current model and try again at the next poll, staleness() shows how far behind it is falling
+                self.lastError = error
+                print("Model refresh failed:", repr(error))
+
+    def _build_shadow_model(self, model, changes):
+        userIds, movieIds, ratings = apply_rating_changes(model, changes)
+        if len(userIds) == 0:
+            return None
+
+        sparseRatings = sparse.csr_matrix(ratings)
+        idsChanged = model is None or len(userIds) != len(model.userIds) or len(movieIds) != len(model.movieIds)
+        if idsChanged or self.fullRebuild or self.metric not in INCREMENTAL_METRICS:
+            neighbourPositions, neighbourScores = similarity.top_k_similar_users(sparseRatings, self.numberOfNeighbours, self.memoryBudgetBytes, self.dtype, metric=self.metric)
+        else:
+            changedUsers = np.unique(userIds.encode_many([change["userId"] for change in changes]))
+            neighbourPositions, neighbourScores = update_neighbour_table(model, sparseRatings, changedUsers, self.memoryBudgetBytes, self.dtype, self.metric)
+
+        return RecommenderModel(userIds, movieIds, ratings, neighbourPositions=neighbourPositions, neighbourScores=neighbourScores, popularity=PopularityIndex.from_ratings(movieIds, ratings))
+
+# returns (user IdEncoder, movie IdEncoder, ratings array) of the model's ratings with the changes applied, always as new arrays.
+# With model=None the changes are applied to no ratings at all, which is how the first model is built, so the same changes give the
+# same arrays however they are split across polls. New users and movies are added in sorted position, so the result is the same as
+# building the arrays from scratch
+def apply_rating_changes(model, changes):
+    changedUserIds = np.array([change["userId"] for change in changes])
+    changedMovieIds = np.array([change["movieId"] for change in changes])
+    ratings = np.array([change["rating"] for change in changes], dtype=np.float64)
+
+    if model is None:
+        userIds, movieIds = IdEncoder.fit(changedUserIds), IdEncoder.fit(changedMovieIds)
+        newRatings = np.zeros((len(userIds), len(movieIds)), dtype=np.float64)
+    else:
+        userIds, movieIds = model.userIds, model.movieIds
+        newUsers = userIds.encode_many(changedUserIds) < 0
+        newMovies = movieIds.encode_many(changedMovieIds) < 0
+        if newUsers.any() or newMovies.any():
+            userIds = IdEncoder.fit(np.concatenate((model.userIds.ids, changedUserIds[newUsers])))
+            movieIds = IdEncoder.fit(np.concatenate((model.movieIds.ids, changedMovieIds[newMovies])))
+            newRatings = np.zeros((len(userIds), len(movieIds)), dtype=model.ratings.dtype)
+            newRatings[np.ix_(userIds.encode_many(model.userIds.ids), movieIds.encode_many(model.movieIds.ids))] = model.ratings
+        else:
+            newRatings = model.ratings.copy()
+
+    # assigned in order, so the last change to a (user, movie) wins
+    newRatings[userIds.encode_many(changedUserIds), movieIds.encode_many(changedMovieIds)] = ratings
+    return userIds, movieIds, newRatings
+
+# returns a new (positions, scores) neighbour table for the ratings after the users at changedUsers changed their ratings, recomputing
+# only the rows that can differ from the model's table: the changed users themselves, users who had one of them as a neighbour
+# (their similarity to it changed, or it may drop out of their list) and users it is now at least as similar to as their least
+# similar neighbour (it may enter their list). Only valid for INCREMENTAL_METRICS, which are also symmetric, so the similarities of the
+# changed users against everyone are also everyone's similarities to the changed users
+def update_neighbour_table(model, sparseRatings, changedUsers, memoryBudgetBytes=similarity.DEFAULT_MEMORY_BUDGET_BYTES, dtype=np.float64, metric=DEFAULT_SIMILARITY_METRIC):
+    positions = model.neighbourPositions.copy()
+    scores = model.neighbourScores.astype(dtype, copy=True)
+    if positions.shape[1] == 0:
+        return positions, scores
+
+    affected = np.isin(positions, changedUsers).any(axis=1)
+    affected[changedUsers] = True
+    leastSimilarNeighbourScores = scores[:, -1]
+    for start, stop, block in similarity.iter_similarity_blocks(sparseRatings, memoryBudgetBytes, dtype, changedUsers, metric):
+        # block[row, u] is the similarity of changed user changedUsers[start + row] and user u
+        affected |= (block >= leastSimilarNeighbourScores[None, :]).any(axis=0)
+
+    affectedUsers = np.flatnonzero(affected)
+    positions[affectedUsers], scores[affectedUsers] = similarity.top_k_similar_users(sparseRatings, positions.shape[1], memoryBudgetBytes, dtype, affectedUsers, metric)
+    return positions, scores
+
+# serves recommendations from a model kept up to date with the ratings collection, printing the model version as it changes
+if __name__ == "__main__":
+    manager = ModelManager(MongoChangeSource(), publishPopularity=True)
+    manager.start()
+    try:
+        while True:
+            time.sleep(manager.pollIntervalSeconds)
+            staleness = manager.staleness()
+            if staleness is None:
+                print("No ratings to build a model from yet")
+            else:
+                print("Serving model version", manager.version, "up to date as of", round(staleness), "seconds ago")
+    except KeyboardInterrupt:
+        manager.stop()
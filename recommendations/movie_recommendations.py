@@ -1,72 +1,172 @@
+import numpy as np
 import pandas as pds
+from scipy import sparse
 from database import dao
-from sklearn.metrics.pairwise import cosine_similarity
+from recommendations import popularity, similarity
+from recommendations.id_encoding import IdEncoder
+from recommendations.recommender_model import RecommenderModel, top_similar_users
+from recommendations.similarity_metrics import DEFAULT_SIMILARITY_METRIC
 
 NUMBER_OF_MOVIES_TO_RETURN = 10 # Number of movies we want to recommend in our top N recommender
+NUMBER_OF_SIMILAR_USERS = 5 # Number of most similar users whose ratings are used to score movies for a user
+NUMBER_OF_NEIGHBOURS_TO_KEEP = 50 # Number of most similar users kept per user when the recommender model is built with a neighbour table rather than the full similarity matrix
+
+_servedPopularity = None # (IdEncoder of the known users, popularity index) served without a user-item matrix, see publish_popularity_index
 
 # generates a list of top N recommendations for a particular user Id. Can choose to exclude movies the user has already watched or not, based on if they have alraedy rated that movie
 # can provide user-item matrix and user-user similarity matrix as parameters if already computed to speed up computation
-def generate_recommendations(userId, excludeAlreadyWatchedMovies, user_item_matrix, user_similarity):
+# n is the number of movies to return and numberOfSimilarUsers the number of most similar users whose ratings the movies are scored from,
+# they default to NUMBER_OF_MOVIES_TO_RETURN and NUMBER_OF_SIMILAR_USERS.
+# similarityMetric picks how user similarity is measured when user_similarity has to be built (see similarity_metrics.SIMILARITY_METRICS)
+# Users with only a few ratings get their scores blended with the popularity prior (see popularity.PopularityIndex), and users not in
+# the user-item matrix, or with no similar users, get the most popular movies instead. Both come from popularityIndex if given and
+# otherwise from build_popularity_index(user_item_matrix), the same ratings build_recommender_model builds its index from; pass it in
+# when generating recommendations for many users from one matrix, so it is built once.
+# Without a user-item matrix, an unknown user is detected from the published known users (see publish_popularity_index) before
+# anything is built or read from the database, so they only cost the popularity lookup, and get the most popular movies from
+# popularityIndex if given and otherwise from the published index
+def generate_recommendations(userId, excludeAlreadyWatchedMovies, user_item_matrix, user_similarity, n=None, numberOfSimilarUsers=None, similarityMetric=DEFAULT_SIMILARITY_METRIC, popularityIndex=None):
+    n = NUMBER_OF_MOVIES_TO_RETURN if n is None else n
     if user_item_matrix is None:
+        knownUserIds, servedPopularityIndex = get_served_popularity()
+        if len(knownUserIds) > 0 and userId not in knownUserIds:
+            return recommend_popular_movies(n, popularityIndex=servedPopularityIndex if popularityIndex is None else popularityIndex)
         user_item_matrix = build_user_item_matrix()
-        if user_item_matrix.empty:
+        if user_item_matrix is None or user_item_matrix.empty:
             return None
-    
+
+    popularityIndex = build_popularity_index(user_item_matrix) if popularityIndex is None else popularityIndex
+    if userId not in IdEncoder.from_index(user_item_matrix.index):
+        return recommend_popular_movies(n, popularityIndex=popularityIndex)
+
     if user_similarity is None:
-        user_similarity = build_user_to_user_similarity_matrix(user_item_matrix)
-        if user_similarity.empty:
+        user_similarity = build_user_to_user_similarity_matrix(user_item_matrix, metric=similarityMetric)
+        if user_similarity is None or user_similarity.empty:
             return None
 
-    top_similar_users = find_most_similar_users_for_specific_user(userId, user_similarity)
-    if not top_similar_users:
-        return None
+    # wrapping the matrices is cheap (no values are copied), the scoring itself then runs on positions rather than pandas labels
+    # scores are blended with the popularity prior by movie position, so only if the index covers exactly the matrix's movies
+    sharesMoviePositions = np.array_equal(popularityIndex.movieIds.ids, user_item_matrix.columns.to_numpy())
+    model = RecommenderModel.from_matrices(user_item_matrix, user_similarity, popularity=popularityIndex if sharesMoviePositions else None)
+    recommendations = model.recommend(
+        userId,
+        excludeAlreadyWatchedMovies,
+        n=n,
+        numberOfSimilarUsers=NUMBER_OF_SIMILAR_USERS if numberOfSimilarUsers is None else numberOfSimilarUsers
+    )
+    if recommendations is None:
+        # no similar users to base recommendations on
+        watchedMovies = get_user_already_watched_movies(userId, user_item_matrix) if excludeAlreadyWatchedMovies else None
+        return recommend_popular_movies(n, watchedMovies, popularityIndex)
+    return recommendations
 
-    if excludeAlreadyWatchedMovies:
-        watchedMovies = get_user_already_watched_movies(userId, user_item_matrix)
-
-    movie_to_score_map = {}
-    for user, user_similarity_score in top_similar_users:
-        for (movieId, rating) in user_item_matrix.loc[user].items():
-            if excludeAlreadyWatchedMovies and movieId in watchedMovies:
-                continue
-            if rating > 0:
-                movieScore = (rating * user_similarity_score)
-                movie_to_score_map[movieId] = movie_to_score_map.get(movieId, 0) + movieScore
-    
-    # Converts the map to a tuple of (movieId, score), sorts based on the score descending (top scores first) and returns top N movies
-    top_movies = dict(sorted(movie_to_score_map.items(), key=lambda item: item[1], reverse=True)[:NUMBER_OF_MOVIES_TO_RETURN])
+# returns the n most popular movieIds (by Bayesian average rating) that are not in watchedMovieIds, from popularityIndex or if that is
+# None from the published index (see get_popularity_index)
+def recommend_popular_movies(n=NUMBER_OF_MOVIES_TO_RETURN, watchedMovieIds=None, popularityIndex=None):
+    popularityIndex = get_popularity_index() if popularityIndex is None else popularityIndex
+    return popularityIndex.recommend(n, watchedMovieIds)
 
-    return list(top_movies.keys())
+# makes userIds (an IdEncoder of the users who have rated a movie) and popularityIndex the ones served to requests that are not given
+# a user-item matrix or a popularity index. Both are published with one assignment, so a request always reads a pair that belongs
+# together. A user who rated their first movie after the pair was built is taken for an unknown user until the next one is published
+def publish_popularity_index(userIds, popularityIndex):
+    global _servedPopularity
+    _servedPopularity = (userIds, popularityIndex)
+
+# builds the known users and the popularity index from the database's rating statistics (see dao.get_movie_rating_statistics and
+# dao.get_user_rating_statistics), without reading the ratings, and publishes them. After the ratings changed this runs two
+# aggregations over them, so it is meant to run off the request path, e.g. on a timer, or see ModelManager(publishPopularity=True)
+def refresh_popularity_index():
+    userStatistics = dao.get_user_rating_statistics()
+    publish_popularity_index(IdEncoder(userStatistics.ids, isSorted=True), popularity.PopularityIndex.from_statistics(dao.get_movie_rating_statistics()))
+
+# returns the published (known users, popularity index). If nothing has been published yet they are built once with
+# refresh_popularity_index, after that requests only ever read what was last published
+def get_served_popularity():
+    if _servedPopularity is None:
+        refresh_popularity_index()
+    return _servedPopularity
+
+def get_popularity_index():
+    return get_served_popularity()[1]
+
+# returns a popularity index built from the ratings in a user-item matrix, sharing its movie positions
+def build_popularity_index(user_item_matrix):
+    return popularity.PopularityIndex.from_ratings(IdEncoder.from_index(user_item_matrix.columns), user_item_matrix.to_numpy())
 
 def get_user_already_watched_movies(userId, user_item_matrix):
-    if userId not in user_item_matrix.index:
+    userPosition = IdEncoder.from_index(user_item_matrix.index).encode(userId)
+    if userPosition < 0:
         return set()
     
-    watched_movies = user_item_matrix.loc[userId]
     # movie is considered 'watched' if it has a rating (i.e. rating is > 0)
-    watched_movies = watched_movies[watched_movies > 0].index  # filter movies that have a rating of 0 from the user-item matrix to get the watched movies
+    watched_movies = user_item_matrix.columns[user_item_matrix.to_numpy()[userPosition] > 0]
     
-    return set(watched_movies)
+    return set(watched_movies.tolist())
 
 def build_user_item_matrix():
     ratings = dao.get_ratings_data()
     if not ratings:
         return None
 
-    df = pds.DataFrame(ratings)
+    userIds, movieIds, ratings_array = build_rating_arrays(ratings)
 
-    user_item_matrix = df.pivot_table(index='userId', columns='movieId', values='rating')
-    user_item_matrix.fillna(0, inplace=True) # fill with 0 if no rating for this movie from this user
+    user_item_matrix = pds.DataFrame(ratings_array, index=pds.Index(userIds.ids, name='userId'), columns=pds.Index(movieIds.ids, name='movieId'))
     return user_item_matrix
 
-def build_user_to_user_similarity_matrix(user_item_matrix):
+# builds the recommender model straight from the ratings data, without going through the pandas user-item and similarity matrices.
+# Similarity is computed in blocks of at most memoryBudgetBytes, in the given dtype (np.float32 halves its memory), and either:
+# - kept as a table of each user's numberOfNeighbours most similar users (the default, memory grows with users x numberOfNeighbours), or
+# - written in full to a memory-mapped .npy file if similarityPath is given, for when the full matrix does not fit in RAM
+# metric picks how user similarity is measured (see similarity_metrics.SIMILARITY_METRICS).
+# The model's popularity index (the fallback for users it cannot personalise for) is built from the same ratings, with per genre
+# rankings as well if popularityByGenre is True
+def build_recommender_model(numberOfNeighbours=NUMBER_OF_NEIGHBOURS_TO_KEEP, dtype=np.float64, memoryBudgetBytes=similarity.DEFAULT_MEMORY_BUDGET_BYTES, similarityPath=None, metric=DEFAULT_SIMILARITY_METRIC, popularityByGenre=False):
+    ratings = dao.get_ratings_data()
+    if not ratings:
+        return None
+
+    userIds, movieIds, ratings_array = build_rating_arrays(ratings)
+    popularityIndex = popularity.PopularityIndex.from_ratings(movieIds, ratings_array, dao.build_movie_genre_map() if popularityByGenre else None)
+    sparse_ratings = sparse.csr_matrix(ratings_array) # similarity is computed on the sparse ratings, which is faster than on the mostly 0 dense array
+    if similarityPath is not None:
+        user_similarity = similarity.similarity_memmap(sparse_ratings, similarityPath, memoryBudgetBytes, dtype, metric=metric)
+        return RecommenderModel(userIds, movieIds, ratings_array, similarity=user_similarity, popularity=popularityIndex)
+
+    neighbourPositions, neighbourScores = similarity.top_k_similar_users(sparse_ratings, numberOfNeighbours, memoryBudgetBytes, dtype, metric=metric)
+    return RecommenderModel(userIds, movieIds, ratings_array, neighbourPositions=neighbourPositions, neighbourScores=neighbourScores, popularity=popularityIndex)
+
+# encodes the userIds and movieIds of the ratings data to positions once, and returns (user IdEncoder, movie IdEncoder, users x movies ratings array)
+# the ratings array has 0 where a user has not rated a movie, if a user rated a movie more than once the mean rating is used
+def build_rating_arrays(ratings):
+    df = pds.DataFrame(ratings)
+
+    userIds = IdEncoder.fit(df['userId'])
+    movieIds = IdEncoder.fit(df['movieId'])
+    userPositions = userIds.encode_many(df['userId']).astype(np.int64)
+    moviePositions = movieIds.encode_many(df['movieId']).astype(np.int64)
+
+    # sum and count the ratings for each (user, movie) cell in one pass, using the flattened cell position as the bin
+    cells = userPositions * len(movieIds) + moviePositions
+    size = len(userIds) * len(movieIds)
+    sums = np.bincount(cells, weights=df['rating'].to_numpy(dtype=np.float64), minlength=size)
+    counts = np.bincount(cells, minlength=size)
+
+    ratings_array = np.zeros(size, dtype=np.float64)
+    np.divide(sums, counts, out=ratings_array, where=counts > 0)
+    return userIds, movieIds, ratings_array.reshape(len(userIds), len(movieIds))
+
+# similarity is computed in blocks of rows so that peak memory is the result plus one block, rather than the result plus
+# full-size temporaries. dtype=np.float32 halves the memory of the result. metric picks how user similarity is measured
+def build_user_to_user_similarity_matrix(user_item_matrix, dtype=np.float64, memoryBudgetBytes=similarity.DEFAULT_MEMORY_BUDGET_BYTES, metric=DEFAULT_SIMILARITY_METRIC):
     if user_item_matrix is None or user_item_matrix.empty:
         return None
-    user_similarity = pds.DataFrame(cosine_similarity(user_item_matrix), index=user_item_matrix.index, columns=user_item_matrix.index)
+    user_similarity = pds.DataFrame(similarity.similarity_matrix(user_item_matrix.to_numpy(), memoryBudgetBytes, dtype, metric=metric), index=user_item_matrix.index, columns=user_item_matrix.index)
     return user_similarity
 
-def find_most_similar_users_for_specific_user(userId, user_similarity, n=5):
-    if userId not in user_similarity:
+def find_most_similar_users_for_specific_user(userId, user_similarity, n=NUMBER_OF_SIMILAR_USERS):
+    userPosition = IdEncoder.from_index(user_similarity.columns).encode(userId)
+    if userPosition < 0:
         return []
-    similar_users = user_similarity[userId].sort_values(ascending=False).iloc[1:n+1] #skip the first element as the most similar user to a user will be the user themselves
-    return list(similar_users.items())
+    similar_users, scores = top_similar_users(user_similarity.to_numpy()[:, userPosition], userPosition, n) # the user themselves is excluded
+    return list(zip(user_similarity.index[similar_users].tolist(), scores.tolist()))
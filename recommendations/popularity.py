@@ -0,0 +1,90 @@
+import numpy as np
+from recommendations.id_encoding import IdEncoder, read_only
+
+PARTIAL_HISTORY_RATINGS = 5 # users with fewer ratings than this have their neighbour based scores blended with the popularity prior
+
+# Fallback ranking of movies for users the recommender knows little or nothing about, ranked by Bayesian average rating:
+#   (priorStrength * globalMean + sum of the movie's ratings) / (priorStrength + number of ratings of the movie)
+# i.e. every movie starts with priorStrength ratings of the global mean rating, so a movie with a handful of 5s does not outrank one
+# that thousands of users rated 4.5. priorStrength defaults to the mean number of ratings per movie.
+# Rankings (movie positions, best first) are computed once when the index is built, globally and optionally per genre, so serving
+# a ranking only reads its first n entries plus at most one entry for every movie filtered out as already watched
+class PopularityIndex:
+
+    def __init__(self, movieIds, counts, sums, movieGenreMap=None, priorStrength=None):
+        self.movieIds = movieIds
+        counts = np.asarray(counts, dtype=np.float64)
+        sums = np.asarray(sums, dtype=np.float64)
+        rated = counts > 0
+        self.globalMean = sums.sum() / counts.sum() if rated.any() else 0.0
+        self.priorStrength = (counts[rated].mean() if rated.any() else 1.0) if priorStrength is None else priorStrength
+
+        # movies nobody has rated get the global mean as their prior score, but are never ranked
+        self.scores = read_only((self.priorStrength * self.globalMean + sums) / (self.priorStrength + counts))
+        ratedPositions = np.flatnonzero(rated)
+        self.ranking = _rank(self.scores, ratedPositions)
+
+        self.genreRankings = {}
+        if movieGenreMap:
+            moviePositions = movieIds.encode_many(list(movieGenreMap.keys()))
+            positionsOfGenre = {}
+            for moviePosition, genres in zip(moviePositions, movieGenreMap.values()):
+                if moviePosition >= 0 and rated[moviePosition]:
+                    for genre in genres.split("|"):
+                        positionsOfGenre.setdefault(genre, []).append(moviePosition)
+            self.genreRankings = {genre: _rank(self.scores, np.array(positions)) for genre, positions in positionsOfGenre.items()}
+
+    # keeps the scores and rankings read-only when an index is sent to another process
+    def __setstate__(self, state):
+        state["scores"], state["ranking"] = read_only(state["scores"]), read_only(state["ranking"])
+        state["genreRankings"] = {genre: read_only(ranking) for genre, ranking in state["genreRankings"].items()}
+        self.__dict__.update(state)
+
+    # builds the index from a users x movies ratings array (0 where a user has not rated a movie), sharing its movie positions
+    @classmethod
+    def from_ratings(cls, movieIds, ratings, movieGenreMap=None, priorStrength=None):
+        return cls(movieIds, (ratings > 0).sum(axis=0), ratings.sum(axis=0), movieGenreMap, priorStrength)
+
+    # builds the index from dao.RatingStatistics of the movies (rating counts and sums aggregated in the database)
+    @classmethod
+    def from_statistics(cls, statistics, movieGenreMap=None, priorStrength=None):
+        return cls(IdEncoder(statistics.ids, isSorted=True), statistics.counts, statistics.sums, movieGenreMap, priorStrength)
+
+    # returns the n best ranked movieIds, leaving out watchedMovieIds, and only from the given genre if genre is not None
+    def recommend(self, n, watchedMovieIds=None, genre=None):
+        watched = None
+        if watchedMovieIds:
+            watched = np.zeros(len(self.movieIds), dtype=bool)
+            watchedPositions = self.movieIds.encode_many(list(watchedMovieIds))
+            watched[watchedPositions[watchedPositions >= 0]] = True
+        return self.movieIds.decode(self.recommend_positions(n, watched, genre))
+
+    # positional version of recommend, watched is a boolean mask over movie positions (or None) of movies to leave out
+    def recommend_positions(self, n, watched=None, genre=None):
+        ranking = self.ranking if genre is None else self.genreRankings.get(genre, self.ranking[:0])
+        if watched is None:
+            return ranking[:n]
+        # at most one ranked movie per watched movie is skipped, so the first n + (number watched) entries always hold the n needed
+        head = ranking[:n + int(np.count_nonzero(watched))]
+        return head[~watched[head]][:n]
+
+# blends the neighbour based scores of a user who has rated fewer than PARTIAL_HISTORY_RATINGS movies with the popularity prior.
+# The neighbour scores (similarity weighted sums of the ratings of the neighbours at neighbourPositions) are turned into a weighted
+# mean rating to be on the same scale as the prior, dividing each movie's score by the similarity of the neighbours who rated it,
+# so a neighbour who has not rated a movie does not count as rating it 0. The user's own evidence gets a weight growing with their
+# number of ratings:
+#   w * neighbour mean + (1 - w) * prior,  w = numberOfRatings / PARTIAL_HISTORY_RATINGS
+# Users with at least PARTIAL_HISTORY_RATINGS ratings keep their neighbour based scores unchanged
+def blend_with_popularity(scores, ratings, neighbourPositions, neighbourScores, numberOfRatings, popularity):
+    if numberOfRatings >= PARTIAL_HISTORY_RATINGS:
+        return scores
+    ratedSimilarity = np.abs(np.asarray(neighbourScores, dtype=np.float64)) @ (ratings[neighbourPositions] > 0)
+    neighbourMean = np.zeros_like(scores)
+    np.divide(scores, ratedSimilarity, out=neighbourMean, where=ratedSimilarity > 0)
+    weight = numberOfRatings / PARTIAL_HISTORY_RATINGS
+    return weight * neighbourMean + (1 - weight) * popularity.scores
+
+# positions sorted by score, best first, ties broken by position so rankings are deterministic
+def _rank(scores, positions):
+    positions = np.asarray(positions, dtype=np.int32)
+    return read_only(positions[np.lexsort((positions, -scores[positions]))])
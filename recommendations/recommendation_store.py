@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from recommendations import movie_recommendations
+from recommendations.id_encoding import IdEncoder
+from recommendations.popularity import PARTIAL_HISTORY_RATINGS
+from recommendations.recommender_model import top_movie_positions
+
+DEFAULT_STORE_DIRECTORY = "recommendation_store"
+VARIANTS = {True: "excluding_watched", False: "including_watched"} # excludeAlreadyWatchedMovies -> file name prefix
+
+# Precomputed top N recommendations for every user, so serving a recommendation is a row lookup with no computation at all.
+# A store is a directory holding one generation directory (generation_1, generation_2, ...) per build or refresh, and metadata.json naming
+# the current one. A generation is a complete set of .npy files that are memory-mapped when read, so opening one is instant and only the
+# rows looked up are paged in:
+# - user_ids.npy / movie_ids.npy: the id index, i.e. the external id at every user / movie position
+# - excluding_watched_movies.npy / including_watched_movies.npy: users x N int32 movie positions, best first, -1 padded
+# - excluding_watched_scores.npy / including_watched_scores.npy: users x N float32 scores of those movies
+# - neighbours.npy: users x numberOfSimilarUsers int32 positions of the similar users each row was scored from (-1 padded)
+# - rating_fingerprints.npy: a hash of every user's ratings when the store was built
+# - popularity.npy: the model's popularity ranking (movie positions, best first), served to users who are not in the store
+# - metadata.json (in the store directory): N, numberOfSimilarUsers and the number of the current generation
+# The neighbours and fingerprints are what let refresh_store recompute only the users affected by ratings that changed since the build.
+# Files are never written once metadata.json names their generation: a build or refresh writes a new generation and then switches
+# metadata.json to it with a single os.replace. So a store always opens one consistent generation, and a store opened earlier keeps
+# reading its own generation, which is only removed two switches later (Windows does not allow replacing a memory-mapped file at all)
+class RecommendationStore:
+
+    def __init__(self, directory=DEFAULT_STORE_DIRECTORY):
+        with open(os.path.join(directory, "metadata.json")) as metadataFile:
+            metadata = json.load(metadataFile)
+        self.n = metadata["n"]
+        self.numberOfSimilarUsers = metadata["numberOfSimilarUsers"]
+        self.generation = metadata["generation"]
+        self.generationDirectory = os.path.join(directory, _generation_name(self.generation))
+
+        self.userIds = IdEncoder(np.load(self._path("user_ids")), isSorted=True)
+        self.movieIds = IdEncoder(np.load(self._path("movie_ids")), isSorted=True)
+        self._movies = {exclude: np.load(self._path(prefix + "_movies"), mmap_mode="r") for exclude, prefix in VARIANTS.items()}
+        self._scores = {exclude: np.load(self._path(prefix + "_scores"), mmap_mode="r") for exclude, prefix in VARIANTS.items()}
+        popularityPath = self._path("popularity")
+        self._popularity = np.load(popularityPath, mmap_mode="r") if os.path.exists(popularityPath) else None
+
+    # returns the stored top n movieIds for a user (best first, at most the N the store was built with). A user who is not in the store
+    # gets the most popular movies if the store was built from a model with a popularity index, and None otherwise
+    def lookup(self, userId, excludeAlreadyWatchedMovies, n=None):
+        recommendations = self.lookup_with_scores(userId, excludeAlreadyWatchedMovies, n)
+        if recommendations is None:
+            if self._popularity is None:
+                return None
+            return self.movieIds.decode(self._popularity[:self.n if n is None else min(n, self.n)])
+        return [movieId for movieId, _ in recommendations]
+
+    # same as lookup, but returns a list of (movieId, score), and None for a user who is not in the store
+    def lookup_with_scores(self, userId, excludeAlreadyWatchedMovies, n=None):
+        userPosition = self.userIds.encode(userId)
+        if userPosition < 0:
+            return None
+
+        moviePositions = self._movies[bool(excludeAlreadyWatchedMovies)][userPosition, :n]
+        scores = self._scores[bool(excludeAlreadyWatchedMovies)][userPosition, :n]
+        found = moviePositions >= 0
+        return list(zip(self.movieIds.decode(moviePositions[found]), scores[found].tolist()))
+
+    def _path(self, name):
+        return os.path.join(self.generationDirectory, name + ".npy")
+
+def store_exists(directory=DEFAULT_STORE_DIRECTORY):
+    return os.path.exists(os.path.join(directory, "metadata.json"))
+
+# computes the top n recommendations (both with and without already watched movies) of every user in the model and writes them to a store
+def build_store(model, directory=DEFAULT_STORE_DIRECTORY, n=None, numberOfSimilarUsers=None):
+    n = movie_recommendations.NUMBER_OF_MOVIES_TO_RETURN if n is None else n
+    numberOfSimilarUsers = movie_recommendations.NUMBER_OF_SIMILAR_USERS if numberOfSimilarUsers is None else numberOfSimilarUsers
+
+    userPositions = np.arange(len(model.userIds))
+    rows = compute_store_rows(model, userPositions, n, numberOfSimilarUsers)
+    rows["neighbours"] = _neighbour_table(model, userPositions, numberOfSimilarUsers)
+    rows["rating_fingerprints"] = rating_fingerprints(model.ratings)
+    if model.popularity is not None:
+        rows["popularity"] = model.popularity.ranking[:n]
+    rows["user_ids"], rows["movie_ids"] = model.userIds.ids, model.movieIds.ids
+    _write_generation(directory, rows, n, numberOfSimilarUsers)
+
+# brings an existing store up to date with a newly built model, recomputing only the users whose recommendations can have changed:
+# users whose ratings changed since the store was built, plus every user who had, or now has, one of those users as a similar user.
+# This is exact for similarity metrics where the similarity of two users only depends on their own ratings (cosine, pearson, jaccard,
+# shrunk_cosine). Adjusted cosine centres on movie means, which any rating changes, so use fullRefresh=True with it.
+# With a popularity index, users with fewer than PARTIAL_HISTORY_RATINGS ratings have scores blended with it, and any rating changes it,
+# so those users are always recomputed too.
+# A full rebuild also happens if the set of users or movies changed. Returns the number of users recomputed
+def refresh_store(model, directory=DEFAULT_STORE_DIRECTORY, fullRefresh=False):
+    if not store_exists(directory):
+        build_store(model, directory)
+        return len(model.userIds)
+
+    store = RecommendationStore(directory)
+    if fullRefresh or not (np.array_equal(store.userIds.ids, model.userIds.ids) and np.array_equal(store.movieIds.ids, model.movieIds.ids)):
+        build_store(model, directory, store.n, store.numberOfSimilarUsers)
+        return len(model.userIds)
+
+    fingerprints = rating_fingerprints(model.ratings)
+    changed = np.flatnonzero(fingerprints != np.load(store._path("rating_fingerprints")))
+    if len(changed) == 0:
+        return 0
+
+    oldNeighbours = np.load(store._path("neighbours"))
+    newNeighbours = _neighbour_table(model, np.arange(len(model.userIds)), store.numberOfSimilarUsers)
+    affected = np.isin(oldNeighbours, changed).any(axis=1) | np.isin(newNeighbours, changed).any(axis=1)
+    if model.popularity is not None:
+        affected |= np.count_nonzero(model.ratings, axis=1) < PARTIAL_HISTORY_RATINGS
+    affected = np.union1d(changed, np.flatnonzero(affected))
+
+    rows = compute_store_rows(model, affected, store.n, store.numberOfSimilarUsers)
+    rows["neighbours"] = newNeighbours[affected]
+    rows["rating_fingerprints"] = fingerprints[affected]
+    # the new generation is the current one with the affected rows replaced, the current one is never written to
+    for name, values in rows.items():
+        stored = np.load(store._path(name))
+        stored[affected] = values
+        rows[name] = stored
+    if model.popularity is not None:
+        rows["popularity"] = model.popularity.ranking[:store.n]
+    rows["user_ids"], rows["movie_ids"] = model.userIds.ids, model.movieIds.ids
+    n, numberOfSimilarUsers = store.n, store.numberOfSimilarUsers
+    del store # close the maps, so the generation can be removed once it is old enough
+    _write_generation(directory, rows, n, numberOfSimilarUsers)
+
+    return len(affected)
+
+# computes the store rows (top n movie positions and scores, with and without already watched movies) for the given user positions
+def compute_store_rows(model, userPositions, n, numberOfSimilarUsers):
+    rows = {}
+    for prefix in VARIANTS.values():
+        rows[prefix + "_movies"] = np.full((len(userPositions), n), -1, dtype=np.int32)
+        rows[prefix + "_scores"] = np.zeros((len(userPositions), n), dtype=np.float32)
+
+    for row, userPosition in enumerate(userPositions):
+        watched = model.ratings[userPosition] > 0
+        movieScores = model.movie_scores(userPosition, numberOfSimilarUsers)
+        if movieScores is None and model.popularity is None:
+            continue
+        # both variants come from the same scores, the already watched movies are just filtered out for one of them.
+        # With no similar users, they are the same popularity ranking the model falls back to
+        scores = model.popularity.scores if movieScores is None else movieScores[0]
+        for exclude, prefix in VARIANTS.items():
+            moviePositions = top_movie_positions(movieScores, n, watched if exclude else None, model.popularity)
+            rows[prefix + "_movies"][row, :len(moviePositions)] = moviePositions
+            rows[prefix + "_scores"][row, :len(moviePositions)] = scores[moviePositions]
+
+    return rows
+
+# a 64 bit hash of each user's row of ratings, used to tell which users' ratings changed between two builds
+def rating_fingerprints(ratings):
+    return np.array([int.from_bytes(hashlib.blake2b(np.ascontiguousarray(row).tobytes(), digest_size=8).digest(), "little") for row in ratings], dtype=np.uint64)
+
+def _neighbour_table(model, userPositions, numberOfSimilarUsers):
+    neighbours = np.full((len(userPositions), numberOfSimilarUsers), -1, dtype=np.int32)
+    for row, userPosition in enumerate(userPositions):
+        neighbourPositions, _ = model.similar_user_positions(userPosition, numberOfSimilarUsers)
+        neighbours[row, :len(neighbourPositions)] = neighbourPositions
+    return neighbours
+
+# writes the arrays as a new generation of the store and then makes it the current one, see RecommendationStore
+def _write_generation(directory, arrays, n, numberOfSimilarUsers):
+    current = None
+    if store_exists(directory):
+        with open(os.path.join(directory, "metadata.json")) as metadataFile:
+            current = json.load(metadataFile)["generation"]
+    generation = 1 if current is None else current + 1
+
+    # a directory left by a build that failed before switching to it was never read, and may hold files the new generation does not have
+    generationDirectory = os.path.join(directory, _generation_name(generation))
+    shutil.rmtree(generationDirectory, ignore_errors=True)
+    os.makedirs(generationDirectory)
+    for name, values in arrays.items():
+        np.save(os.path.join(generationDirectory, name + ".npy"), values)
+
+    # the switch: metadata.json is replaced whole, so it names either the old generation or the complete new one
+    temporaryPath = os.path.join(directory, "metadata.tmp.json")
+    with open(temporaryPath, "w") as metadataFile:
+        json.dump({"n": n, "numberOfSimilarUsers": numberOfSimilarUsers, "generation": generation}, metadataFile)
+    os.replace(temporaryPath, os.path.join(directory, "metadata.json"))
+
+    # the previous generation is kept for stores opened before the switch. Older ones are removed, except for files a reader still has
+    # memory-mapped on Windows, which fail to delete and are left behind
+    for entry in os.listdir(directory):
+        if entry.startswith("generation_") and entry not in (_generation_name(generation), _generation_name(generation - 1)):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+def _generation_name(generation):
+    return "generation_" + str(generation)
+
+# materialisation job: builds the store from the database, or refreshes it if one already exists
+if __name__ == "__main__":
+    model = movie_recommendations.build_recommender_model()
+    print("Recomputed recommendations for", refresh_store(model), "users")
@@ -0,0 +1,168 @@
+import numpy as np
+from recommendations.id_encoding import IdEncoder, read_only
+from recommendations.popularity import blend_with_popularity
+
+# Holds everything needed to serve recommendations as positional numpy arrays:
+# - userIds / movieIds: IdEncoders translating external ids to row / column positions and back
+# - ratings: users x movies array of ratings, 0 where a user has not rated a movie
+# - similarity: users x users array of user-to-user similarity scores (can be a read-only memory-mapped array), and/or
+# - neighbourPositions / neighbourScores: users x k arrays holding only each user's k most similar users, most similar first
+#   (see similarity.top_k_similar_users). When these are present they are used instead of the full similarity matrix
+# - popularity: optional popularity.PopularityIndex over the same movie positions. With it, unknown users and users with no similar
+#   users get the popularity ranking rather than None, and users with only a few ratings get their scores blended with it
+# External ids are only translated at the boundary (recommend, most_similar_users, watched_movies), everything else works on positions.
+# A model is immutable: its arrays are held as read-only views and its attributes cannot be reassigned, and every call works in its
+# own scratch arrays, so one model can serve any number of threads at once without locking. The heavy work of a call (gathering the
+# neighbours' ratings, the weighted sum, partitioning and sorting the scores) runs in numpy kernels that release the GIL.
+# To change a model, build a new one (see model_manager.ModelManager)
+class RecommenderModel:
+    _arrays = ("ratings", "similarity", "neighbourPositions", "neighbourScores")
+
+    def __init__(self, userIds, movieIds, ratings, similarity=None, neighbourPositions=None, neighbourScores=None, popularity=None):
+        if similarity is None and neighbourPositions is None:
+            raise ValueError("either a similarity matrix or a neighbour table is required")
+        self.userIds = userIds
+        self.movieIds = movieIds
+        self.ratings = read_only(ratings)
+        self.similarity = read_only(similarity)
+        self.neighbourPositions = read_only(neighbourPositions)
+        self.neighbourScores = read_only(neighbourScores)
+        self.popularity = popularity
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError("RecommenderModel is immutable, build a new model instead of setting '" + name + "'")
+        super().__setattr__(name, value)
+
+    # a model sent to another process (e.g. the sweep's worker pool) is unpickled with writable copies of its arrays, so make them read-only again
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self._arrays:
+            self.__dict__[name] = read_only(state[name])
+
+    # wraps an already built user-item matrix and user-user similarity matrix (pandas DataFrames) without copying their values.
+    # The model only holds read-only views of the frames' values, so the frames must not be modified while the model is in use
+    @classmethod
+    def from_matrices(cls, user_item_matrix, user_similarity, popularity=None):
+        # the similarity matrix built by build_user_to_user_similarity_matrix shares its index with the user-item matrix,
+        # only realign it (which copies) if it was built some other way
+        if not (user_similarity.index is user_item_matrix.index and user_similarity.columns is user_item_matrix.index):
+            if not (user_similarity.index.equals(user_item_matrix.index) and user_similarity.columns.equals(user_item_matrix.index)):
+                user_similarity = user_similarity.reindex(index=user_item_matrix.index, columns=user_item_matrix.index, fill_value=0)
+
+        return cls(
+            IdEncoder.from_index(user_item_matrix.index),
+            IdEncoder.from_index(user_item_matrix.columns),
+            user_item_matrix.to_numpy(),
+            user_similarity.to_numpy(),
+            popularity=popularity
+        )
+
+    # returns a list of (userId, similarity score) for the n users most similar to the given user, most similar first
+    def most_similar_users(self, userId, n):
+        userPosition = self.userIds.encode(userId)
+        if userPosition < 0:
+            return []
+        positions, scores = self.similar_user_positions(userPosition, n)
+        return list(zip(self.userIds.decode(positions), scores.tolist()))
+
+    # returns the set of movieIds the user has rated
+    def watched_movies(self, userId):
+        userPosition = self.userIds.encode(userId)
+        if userPosition < 0:
+            return set()
+        return set(self.movieIds.decode(np.flatnonzero(self.ratings[userPosition] > 0)))
+
+    # returns the top n movieIds for a user (best first). If the user is unknown or has no similar users to base recommendations on,
+    # returns the popularity ranking if the model has one and None otherwise
+    def recommend(self, userId, excludeAlreadyWatchedMovies, n, numberOfSimilarUsers):
+        userPosition = self.userIds.encode(userId)
+        if userPosition < 0:
+            if self.popularity is None:
+                return None
+            return self.movieIds.decode(self.popularity.recommend_positions(n)) # an unknown user has watched nothing
+
+        moviePositions = self.recommend_positions(userPosition, excludeAlreadyWatchedMovies, n, numberOfSimilarUsers)
+        if moviePositions is None:
+            return None
+        return self.movieIds.decode(moviePositions)
+
+    # positional version of recommend, returns an array of movie positions (best first)
+    def recommend_positions(self, userPosition, excludeAlreadyWatchedMovies, n, numberOfSimilarUsers):
+        watched = self.ratings[userPosition] > 0 if excludeAlreadyWatchedMovies else None
+        return top_movie_positions(self.movie_scores(userPosition, numberOfSimilarUsers), n, watched, self.popularity)
+
+    # returns (score of every movie, mask of candidate movies) for the user from their numberOfSimilarUsers most similar users,
+    # blended with the popularity prior if the user has only a few ratings, or None if the user has no similar users
+    def movie_scores(self, userPosition, numberOfSimilarUsers):
+        neighbourPositions, neighbourScores = self.similar_user_positions(userPosition, numberOfSimilarUsers)
+        return user_movie_scores(self.ratings, userPosition, neighbourPositions, neighbourScores, self.popularity)
+
+    # returns (positions, scores) of the n users most similar to the user at userPosition, most similar first.
+    # With a neighbour table, at most k users (the width of the table) can be returned
+    def similar_user_positions(self, userPosition, n):
+        if self.neighbourPositions is not None and (self.similarity is None or n <= self.neighbourPositions.shape[1]):
+            # the table is already sorted, so the n most similar users are just its first n columns
+            return self.neighbourPositions[userPosition, :n], self.neighbourScores[userPosition, :n]
+        return top_similar_users(self.similarity[userPosition], userPosition, n)
+
+
+# returns (positions, scores) of the n users most similar to the user at userPosition, most similar first.
+# The user themselves is never returned, ties are broken by position so results are deterministic
+def top_similar_users(similarityRow, userPosition, n):
+    n = min(n, len(similarityRow) - 1)
+    if n <= 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=similarityRow.dtype)
+
+    scores = np.array(similarityRow, dtype=np.float64) # per-call copy, so excluding the user below never writes into the model
+    scores[userPosition] = -np.inf
+
+    return _top_n(scores, np.flatnonzero(scores > -np.inf), n)
+
+# returns (score of every movie, mask of candidate movies) for the user at userPosition from the neighbours at neighbourPositions,
+# blended with the popularity prior if one is given and the user has only a few ratings, or None if the user has no neighbours.
+# neighbourMovieScores is the neighbours' score_movies result if it has already been computed.
+# The model and the evaluators all score users through this and top_movie_positions, so they rank every user the same way
+def user_movie_scores(ratings, userPosition, neighbourPositions, neighbourScores, popularity=None, neighbourMovieScores=None):
+    if len(neighbourPositions) == 0:
+        return None
+    scores, candidates = score_movies(ratings, neighbourPositions, neighbourScores) if neighbourMovieScores is None else neighbourMovieScores
+    if popularity is not None:
+        scores = blend_with_popularity(scores, ratings, neighbourPositions, neighbourScores, np.count_nonzero(ratings[userPosition]), popularity)
+    return scores, candidates
+
+# returns the positions of the n best movies (best first) by a user_movie_scores result, leaving out the movies in the boolean mask
+# watched if it is not None. Without scores, returns the popularity ranking if a popularity index is given and None otherwise
+def top_movie_positions(movieScores, n, watched=None, popularity=None):
+    if movieScores is None:
+        if popularity is None:
+            return None
+        return popularity.recommend_positions(n, watched)
+    scores, candidates = movieScores
+    return top_scoring_positions(scores, candidates if watched is None else candidates & ~watched, n)
+
+# weighted sum of the neighbours' ratings, returns (score of every movie, mask of movies at least one neighbour has rated)
+def score_movies(ratings, neighbourPositions, neighbourScores):
+    neighbourRatings = ratings[neighbourPositions]
+    scores = np.asarray(neighbourScores, dtype=np.float64) @ neighbourRatings
+    candidates = (neighbourRatings > 0).any(axis=0)
+    return scores, candidates
+
+# returns the positions of the n highest scoring candidates, best first
+def top_scoring_positions(scores, candidates, n):
+    positions, _ = _top_n(scores, np.flatnonzero(candidates), n)
+    return positions
+
+def _top_n(scores, positions, n):
+    if len(positions) > n:
+        # only fully sort the n best rather than every position. Partitioning gives the n-th best score, everything better
+        # is kept and the remaining places go to the lowest positions with exactly that score, so ties never depend on the partition
+        candidateScores = scores[positions]
+        nthBestScore = -np.partition(-candidateScores, n - 1)[n - 1]
+        better = positions[candidateScores > nthBestScore]
+        tied = positions[candidateScores == nthBestScore][:n - len(better)]
+        positions = np.concatenate((better, tied))
+    order = np.lexsort((positions, -scores[positions]))
+    positions = positions[order].astype(np.int32)
+    return positions, scores[positions]
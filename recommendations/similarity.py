@@ -0,0 +1,61 @@
+import numpy as np
+from recommendations.recommender_model import top_similar_users
+from recommendations.similarity_metrics import DEFAULT_SIMILARITY_METRIC, create_similarity_metric
+
+DEFAULT_MEMORY_BUDGET_BYTES = 64 * 1024 * 1024 # upper bound on the size of each block of similarity scores held in memory at once
+
+# Computes user-to-user similarity one block of rows at a time, so the full users x users result never has to be
+# held in memory alongside its temporaries. Each block is (block rows x all users) and is sized to fit within memoryBudgetBytes.
+# dtype can be np.float32 to halve the memory of both the blocks and the result, at the cost of ~7 significant digits.
+# metric is one of similarity_metrics.SIMILARITY_METRICS ("cosine", "pearson", "adjusted_cosine", "jaccard", "shrunk_cosine")
+# and ratings can be a dense array or a scipy sparse matrix.
+# Yields (start, stop, block) where block holds the similarity scores of users start..stop-1 against every user.
+# If userPositions is given, only the rows of those users are computed and start/stop index into userPositions instead
+def iter_similarity_blocks(ratings, memoryBudgetBytes=DEFAULT_MEMORY_BUDGET_BYTES, dtype=np.float64, userPositions=None, metric=DEFAULT_SIMILARITY_METRIC):
+    similarityMetric = create_similarity_metric(metric, ratings, dtype)
+    # plug-in metrics only have to provide block(rows), see similarity_metrics.create_similarity_metric
+    numberOfUsers = getattr(similarityMetric, "numberOfUsers", np.shape(ratings)[0])
+    temporariesPerRow = getattr(similarityMetric, "temporariesPerRow", 1)
+    numberOfRows = numberOfUsers if userPositions is None else len(userPositions)
+
+    rowsPerBlock = max(1, int(memoryBudgetBytes // max(1, numberOfUsers * np.dtype(dtype).itemsize * temporariesPerRow)))
+    for start in range(0, numberOfRows, rowsPerBlock):
+        stop = min(start + rowsPerBlock, numberOfRows)
+        rows = slice(start, stop) if userPositions is None else userPositions[start:stop]
+        yield start, stop, similarityMetric.block(rows)
+
+# returns the full users x users similarity matrix, computed block by block into 'out' (or a new array if out is None)
+def similarity_matrix(ratings, memoryBudgetBytes=DEFAULT_MEMORY_BUDGET_BYTES, dtype=np.float64, out=None, metric=DEFAULT_SIMILARITY_METRIC):
+    numberOfUsers = np.shape(ratings)[0]
+    if out is None:
+        out = np.empty((numberOfUsers, numberOfUsers), dtype=dtype)
+
+    for start, stop, block in iter_similarity_blocks(ratings, memoryBudgetBytes, dtype, metric=metric):
+        out[start:stop] = block
+    return out
+
+# streams the full similarity matrix into a memory-mapped .npy file at 'path', so it can be larger than the available RAM.
+# The returned matrix is opened read-only and can be indexed like a normal array (only the rows used are paged in)
+def similarity_memmap(ratings, path, memoryBudgetBytes=DEFAULT_MEMORY_BUDGET_BYTES, dtype=np.float64, metric=DEFAULT_SIMILARITY_METRIC):
+    numberOfUsers = np.shape(ratings)[0]
+    similarity = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(numberOfUsers, numberOfUsers))
+    similarity_matrix(ratings, memoryBudgetBytes, dtype, out=similarity, metric=metric)
+    similarity.flush()
+    del similarity
+    return np.load(path, mmap_mode="r")
+
+# keeps only the k most similar users of every user (excluding the user themselves), most similar first.
+# Returns (positions, scores), two users x k arrays, so memory grows with users x k rather than users x users.
+# If userPositions is given, only those users' rows are computed and the returned arrays have one row per entry of userPositions
+def top_k_similar_users(ratings, k, memoryBudgetBytes=DEFAULT_MEMORY_BUDGET_BYTES, dtype=np.float64, userPositions=None, metric=DEFAULT_SIMILARITY_METRIC):
+    numberOfUsers = np.shape(ratings)[0]
+    k = max(0, min(k, numberOfUsers - 1))
+    rowPositions = np.arange(numberOfUsers) if userPositions is None else np.asarray(userPositions)
+
+    positions = np.empty((len(rowPositions), k), dtype=np.int32)
+    scores = np.empty((len(rowPositions), k), dtype=dtype)
+    for start, stop, block in iter_similarity_blocks(ratings, memoryBudgetBytes, dtype, userPositions, metric):
+        for row in range(stop - start):
+            positions[start + row], scores[start + row] = top_similar_users(block[row], rowPositions[start + row], k)
+
+    return positions, scores
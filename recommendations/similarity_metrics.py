@@ -0,0 +1,158 @@
+import numpy as np
+from scipy import sparse
+
+DEFAULT_SIMILARITY_METRIC = "cosine"
+
+# User-to-user similarity metrics, all computed a block of rows at a time (see similarity.iter_similarity_blocks).
+# A metric is created once for a ratings matrix (users x movies, 0 where a user has not rated a movie, dense or scipy sparse) and
+# block(rows) then returns the dense (len(rows) x users) similarities of those users against every user.
+# Apart from cosine on a dense matrix, the ratings are kept sparse (CSR) and nothing users x movies is ever densified:
+# mean-centred metrics are expanded algebraically into sparse products, row sums and rated-movie counts instead of building a centred copy.
+# temporariesPerRow is roughly how many (rows x users) arrays block() holds at once, used to size blocks within the memory budget.
+# A sparse product of a block of users against every user is nearly dense, and takes about 1.5 times the memory of a dense array
+class SimilarityMetric:
+    temporariesPerRow = 1
+
+    def __init__(self, ratings, dtype=np.float64):
+        self.dtype = dtype
+        self.ratings = sparse.csr_matrix(ratings, dtype=dtype) # no copy if the ratings are already a CSR matrix of this dtype
+        self.rated = self.ratings.copy()
+        self.rated.data = np.ones_like(self.rated.data) # 1 wherever a user has rated a movie
+        self.numberOfUsers = self.ratings.shape[0]
+
+    def block(self, rows):
+        raise NotImplementedError
+
+    # sum over movies rated by both users, of left[u, movie] * right[v, movie], for the users in rows (u) against every user (v)
+    def _co_rated_sum(self, left, right, rows):
+        return (left[rows] @ right.T).toarray()
+
+# cosine of the angle between two users' rating vectors (unrated movies count as 0), the similarity used by the recommender so far
+class CosineSimilarity(SimilarityMetric):
+
+    def __init__(self, ratings, dtype=np.float64):
+        # a dense matrix is kept dense (a block is then a single BLAS matrix product), a sparse one is kept sparse
+        self.dtype = dtype
+        self.ratings = sparse.csr_matrix(ratings, dtype=dtype) if sparse.issparse(ratings) else np.asarray(ratings, dtype=dtype)
+        self.numberOfUsers = self.ratings.shape[0]
+        self.temporariesPerRow = 3 if sparse.issparse(self.ratings) else 1
+
+        norms = np.sqrt(np.asarray(self.ratings.multiply(self.ratings).sum(axis=1)).ravel() if sparse.issparse(self.ratings) else np.einsum("ij,ij->i", self.ratings, self.ratings))
+        norms[norms == 0] = 1 # users with no ratings have a similarity of 0 with everyone, rather than dividing by 0
+        self.norms = norms.astype(dtype)
+
+    def block(self, rows):
+        block = self.ratings[rows] @ self.ratings.T
+        block = block.toarray() if sparse.issparse(block) else block
+        # normalise in place rather than normalising a copy of the ratings up front
+        block /= self.norms[rows, None]
+        block /= self.norms[None, :]
+        return block
+
+# Pearson correlation of two users' ratings over the movies both of them have rated, i.e. each user is centred on their mean rating
+# of the co-rated movies. For users u and v with n co-rated movies:
+#   (sum(xy) - sum(x)sum(y)/n) / sqrt((sum(x^2) - sum(x)^2/n) * (sum(y^2) - sum(y)^2/n))
+# where every sum is over the co-rated movies, so each one is a single sparse product of the ratings, squared ratings and rated indicator.
+# Users with fewer than 2 co-rated movies (or no variation in them) have a similarity of 0
+class PearsonSimilarity(SimilarityMetric):
+    temporariesPerRow = 10
+
+    def __init__(self, ratings, dtype=np.float64):
+        super().__init__(ratings, dtype)
+        self.squaredRatings = self.ratings.multiply(self.ratings).tocsr()
+
+    def block(self, rows):
+        coRated = self._co_rated_sum(self.rated, self.rated, rows)
+        sumX = self._co_rated_sum(self.ratings, self.rated, rows)
+        sumY = self._co_rated_sum(self.rated, self.ratings, rows)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariance = self._co_rated_sum(self.ratings, self.ratings, rows) - sumX * sumY / coRated
+            varianceX = self._co_rated_sum(self.squaredRatings, self.rated, rows) - sumX ** 2 / coRated
+            varianceY = self._co_rated_sum(self.rated, self.squaredRatings, rows) - sumY ** 2 / coRated
+            block = covariance / np.sqrt(varianceX * varianceY)
+
+        # rounding can leave a tiny non-zero variance where there is none, so treat anything that small as no variation
+        tolerance = np.finfo(self.dtype).eps * 64 * np.maximum(1, self._co_rated_sum(self.squaredRatings, self.rated, rows))
+        block[~((coRated > 1) & (varianceX > tolerance) & (varianceY > tolerance))] = 0
+        return np.clip(block, -1, 1, out=block)
+
+# cosine similarity after centring every rating on the movie's mean rating, which removes the effect of some movies simply being rated higher.
+# With m the movie means and only rated movies centred, (x - m).(y - m) over co-rated movies expands to
+#   sum(xy) - sum(x m) - sum(m y) + sum(m^2)
+# and each user's norm to sum(x^2) - 2 sum(x m) + sum(m^2) over their rated movies, so the centred ratings are never materialised
+class AdjustedCosineSimilarity(SimilarityMetric):
+    temporariesPerRow = 5
+
+    def __init__(self, ratings, dtype=np.float64):
+        super().__init__(ratings, dtype)
+        ratingCounts = np.asarray(self.rated.sum(axis=0)).ravel()
+        ratingSums = np.asarray(self.ratings.sum(axis=0)).ravel()
+        self.movieMeans = np.divide(ratingSums, ratingCounts, out=np.zeros(len(ratingSums), dtype=dtype), where=ratingCounts > 0)
+        self.meanScaling = sparse.diags(self.movieMeans)
+        self.squaredMeanScaling = sparse.diags(self.movieMeans ** 2)
+
+        squaredNorms = (
+            np.asarray(self.ratings.multiply(self.ratings).sum(axis=1)).ravel()
+            - 2 * (self.ratings @ self.movieMeans)
+            + self.rated @ (self.movieMeans ** 2)
+        )
+        norms = np.sqrt(np.maximum(squaredNorms, 0))
+        norms[norms < np.finfo(dtype).eps * 64] = 1 # users whose ratings all equal the movie means have a similarity of 0 with everyone
+        self.norms = norms.astype(dtype)
+
+    def block(self, rows):
+        block = self._co_rated_sum(self.ratings, self.ratings, rows)
+        block -= ((self.ratings[rows] @ self.meanScaling) @ self.rated.T).toarray()
+        block -= ((self.rated[rows] @ self.meanScaling) @ self.ratings.T).toarray()
+        block += ((self.rated[rows] @ self.squaredMeanScaling) @ self.rated.T).toarray()
+        block /= self.norms[rows, None]
+        block /= self.norms[None, :]
+        return np.clip(block, -1, 1, out=block)
+
+# number of movies both users have rated divided by the number of movies either of them has rated, ignoring the rating values
+class JaccardSimilarity(SimilarityMetric):
+    temporariesPerRow = 4
+
+    def __init__(self, ratings, dtype=np.float64):
+        super().__init__(ratings, dtype)
+        self.ratingCounts = np.asarray(self.rated.sum(axis=1)).ravel().astype(dtype)
+
+    def block(self, rows):
+        intersection = self._co_rated_sum(self.rated, self.rated, rows)
+        union = self.ratingCounts[rows, None] + self.ratingCounts[None, :] - intersection
+        return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+# cosine similarity scaled by n / (n + shrinkage), where n is the number of co-rated movies, so that similarities based on only a
+# handful of shared movies are pulled towards 0
+class ShrunkCosineSimilarity(CosineSimilarity):
+    shrinkage = 100
+
+    def __init__(self, ratings, dtype=np.float64, shrinkage=None):
+        super().__init__(ratings, dtype)
+        self.temporariesPerRow += 3
+        if shrinkage is not None:
+            self.shrinkage = shrinkage
+        self.rated = sparse.csr_matrix(self.ratings, dtype=dtype)
+        self.rated.data = np.ones_like(self.rated.data)
+
+    def block(self, rows):
+        coRated = (self.rated[rows] @ self.rated.T).toarray()
+        return super().block(rows) * (coRated / (coRated + self.shrinkage))
+
+SIMILARITY_METRICS = {
+    "cosine": CosineSimilarity,
+    "pearson": PearsonSimilarity,
+    "adjusted_cosine": AdjustedCosineSimilarity,
+    "jaccard": JaccardSimilarity,
+    "shrunk_cosine": ShrunkCosineSimilarity,
+}
+
+# creates the metric for the given ratings. metric can be the name of one of SIMILARITY_METRICS, or any callable taking
+# (ratings, dtype) and returning an object with a block(rows) method, e.g. lambda ratings, dtype: ShrunkCosineSimilarity(ratings, dtype, shrinkage=25).
+# numberOfUsers and temporariesPerRow are optional on such an object, they default to the number of rows of the ratings and 1
+def create_similarity_metric(metric, ratings, dtype=np.float64):
+    if isinstance(metric, str):
+        if metric not in SIMILARITY_METRICS:
+            raise ValueError("unknown similarity metric '" + metric + "', expected one of " + ", ".join(SIMILARITY_METRICS))
+        metric = SIMILARITY_METRICS[metric]
+    return metric(ratings, dtype)
@@ -0,0 +1,17 @@
+import numpy as np
+
+# mock data shared by the evaluation test suites (cutoff metrics, sampled evaluation and the sweep), so they all run on the same ratings
+
+# 12 users with between 2 and 7 ratings each, across 10 movies
+def get_mock_ratings_data():
+    rng = np.random.default_rng(7)
+    ratings = []
+    for userId in range(1, 13):
+        movieIds = rng.choice(np.arange(101, 111), size=2 + userId % 6, replace=False)
+        for movieId in movieIds:
+            ratings.append({"userId": userId, "movieId": int(movieId), "rating": float(rng.integers(1, 6))})
+    return ratings
+
+def get_mock_movie_genre_map():
+    genres = ["Action|Adventure", "Comedy", "Drama|Romance", "Action|Comedy", "Horror"]
+    return {movieId: genres[movieId % len(genres)] for movieId in range(101, 111)}
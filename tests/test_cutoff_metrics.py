@@ -0,0 +1,95 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from tests import mock_data
+from evaluator import evaluator, cutoff_metrics
+from recommendations import movie_recommendations
+from recommendations.id_encoding import IdEncoder
+
+class TestCutoffMetrics(unittest.TestCase):
+
+    @patch("database.dao.build_movie_genre_map")
+    @patch("database.dao.get_ratings_data")
+    def test_metrics_at_cutoffs_match_single_cutoff_evaluation(self, mock_get_ratings_data, mock_build_movie_genre_map):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        mock_build_movie_genre_map.return_value = mock_data.get_mock_movie_genre_map()
+
+        results = cutoff_metrics.evaluate_at_cutoffs(cutoffs=(2, 3, 5))
+
+        self.assertEqual(results.columns.tolist(), [2, 3, 5])
+        LOOCVTestData = evaluator.generateLOOCVTestData()
+        # each column must be what a full evaluation gives with NUMBER_OF_MOVIES_TO_RETURN set to that cutoff
+        for cutoff in (2, 3, 5):
+            with patch("recommendations.movie_recommendations.NUMBER_OF_MOVIES_TO_RETURN", cutoff):
+                recommendationsForHitRate = evaluator.generate_recommendations_for_all_users(excludeAlreadyWatchedMovies=False)
+                recommendations = evaluator.generate_recommendations_for_all_users(excludeAlreadyWatchedMovies=True)
+
+            self.assertAlmostEqual(results.loc["Hit rate", cutoff], evaluator.calculateHitRate(recommendationsForHitRate, LOOCVTestData))
+            self.assertAlmostEqual(results.loc["Average Reciprocal Hit rate", cutoff], evaluator.calculateAverageReciprocalHitRate(recommendationsForHitRate, LOOCVTestData))
+            self.assertAlmostEqual(results.loc["Coverage", cutoff], evaluator.calculateCoverage(recommendations))
+            self.assertAlmostEqual(results.loc["Diversity", cutoff], evaluator.calculateAverageGiniSimpsonDiversityAcrossAllUsers(recommendations, mock_data.get_mock_movie_genre_map()))
+            self.assertAlmostEqual(results.loc["Novelty", cutoff], evaluator.calculateAverageNoveltyAcrossAllUsers(recommendations))
+
+    @patch("database.dao.get_ratings_data")
+    def test_ranked_recommendation_tables_score_each_user_once(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        model = movie_recommendations.build_recommender_model()
+
+        with patch("evaluator.cutoff_metrics.score_movies", wraps=cutoff_metrics.score_movies) as mock_score_movies:
+            rankedForHitRate, ranked = cutoff_metrics.ranked_recommendation_tables(model, 4, numberOfSimilarUsers=5)
+
+        self.assertEqual(mock_score_movies.call_count, len(model.userIds))
+        self.assertEqual(ranked.shape, (12, 4))
+        # the already watched movies are excluded from the second table only
+        for userPosition in range(len(model.userIds)):
+            watched = set(np.flatnonzero(model.ratings[userPosition] > 0).tolist())
+            self.assertFalse(watched & set(ranked[userPosition].tolist()))
+
+    @patch("database.dao.build_movie_genre_map")
+    @patch("database.dao.get_ratings_data")
+    def test_model_is_built_wide_enough_for_the_number_of_similar_users(self, mock_get_ratings_data, mock_build_movie_genre_map):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        mock_build_movie_genre_map.return_value = mock_data.get_mock_movie_genre_map()
+
+        with patch("recommendations.movie_recommendations.NUMBER_OF_NEIGHBOURS_TO_KEEP", 3):
+            with patch("recommendations.movie_recommendations.build_recommender_model", wraps=movie_recommendations.build_recommender_model) as mock_build_recommender_model:
+                cutoff_metrics.evaluate_at_cutoffs(cutoffs=(2,), numberOfSimilarUsers=6)
+        mock_build_recommender_model.assert_called_once_with(numberOfNeighbours=6, metric="cosine")
+
+        # a model given with too narrow a neighbour table is not quietly evaluated with fewer similar users
+        with self.assertRaises(ValueError):
+            cutoff_metrics.evaluate_at_cutoffs(cutoffs=(2,), model=movie_recommendations.build_recommender_model(numberOfNeighbours=3), numberOfSimilarUsers=6)
+
+    def test_hit_ranks(self):
+        rankedForHitRate = np.array([
+            [3, 1, 2],
+            [4, 5, -1],
+            [1, 2, 3],
+        ])
+        leftOutMovies = np.array([2, 6, -1]) # user 3 has no left-out movie
+
+        self.assertEqual(cutoff_metrics.hit_ranks(rankedForHitRate, leftOutMovies).tolist(), [2, 3, 3])
+
+    def test_diversity_per_user(self):
+        movieIds = IdEncoder.fit([101, 102, 103])
+        genreIndicator = cutoff_metrics.build_genre_indicator({101: "Action|Adventure|Drama", 102: "Action|Comedy", 103: "Drama|Romance"}, movieIds)
+        prefix = np.array([
+            [0, 1, 2],
+            [-1, -1, -1], # no recommendations
+        ])
+
+        result = cutoff_metrics.diversity_per_user(prefix, genreIndicator)
+
+        self.assertAlmostEqual(result[0], evaluator.calculateGiniSimpsonDiversity([101, 102, 103], {101: "Action|Adventure|Drama", 102: "Action|Comedy", 103: "Drama|Romance"}))
+        self.assertTrue(np.isnan(result[1]))
+
+    def test_novelty_per_user(self):
+        prefix = np.array([
+            [0, 1],
+            [0, -1],
+        ])
+
+        result = cutoff_metrics.novelty_per_user(prefix)
+
+        # movie 0 is recommended to both users (log2(2/2) = 0), movie 1 to one user (log2(2/1) = 1)
+        self.assertEqual(result.tolist(), [0.5, 0.0])
@@ -0,0 +1,76 @@
+import unittest
+from unittest.mock import patch
+import mongomock
+import numpy as np
+from database import dao
+
+class TestDaoStatistics(unittest.TestCase):
+
+    def setUp(self):
+        # the statistics pipelines run against an in-memory stand-in for the database
+        self.db = mongomock.MongoClient()["movieDB"]
+        self.db["ratings"].insert_many([
+            {"userId": 1, "movieId": 101, "rating": 5.0},
+            {"userId": 1, "movieId": 102, "rating": 3.0},
+            {"userId": 2, "movieId": 101, "rating": 4.0},
+            {"userId": 3, "movieId": 103, "rating": 2.5},
+        ])
+        self.db["movies"].insert_many([
+            {"movieId": 101, "title": "Movie 1", "genres": "Action|Comedy"},
+            {"movieId": 102, "title": "Movie 2", "genres": "Comedy"},
+            {"movieId": 103, "title": "Movie 3", "genres": "Drama|Action|Thriller"},
+        ])
+        patcher = patch("database.dao.db", self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        dao.clear_statistics_cache()
+        self.addCleanup(dao.clear_statistics_cache)
+
+    def test_movie_rating_statistics(self):
+        statistics = dao.get_movie_rating_statistics()
+
+        np.testing.assert_array_equal(statistics.ids, [101, 102, 103])
+        np.testing.assert_array_equal(statistics.counts, [2, 1, 1])
+        np.testing.assert_allclose(statistics.sums, [9.0, 3.0, 2.5])
+
+    def test_user_rating_statistics(self):
+        statistics = dao.get_user_rating_statistics()
+
+        np.testing.assert_array_equal(statistics.ids, [1, 2, 3])
+        np.testing.assert_array_equal(statistics.counts, [2, 1, 1])
+        np.testing.assert_allclose(statistics.sums, [8.0, 4.0, 2.5])
+
+    def test_genre_vocabulary(self):
+        genres, movieCounts = dao.get_genre_vocabulary()
+
+        self.assertEqual(genres, ["Action", "Comedy", "Drama", "Thriller"])
+        np.testing.assert_array_equal(movieCounts, [2, 2, 1, 1])
+
+    def test_statistics_are_cached_until_the_data_changes(self):
+        first = dao.get_movie_rating_statistics()
+        with patch.object(dao, "_rating_statistics") as mock_rating_statistics:
+            self.assertIs(dao.get_movie_rating_statistics(), first) # same data, so the pipeline is not run again
+            mock_rating_statistics.assert_not_called()
+
+        self.db["ratings"].insert_one({"userId": 3, "movieId": 102, "rating": 4.0})
+        statistics = dao.get_movie_rating_statistics()
+
+        np.testing.assert_array_equal(statistics.counts, [2, 2, 1])
+        np.testing.assert_allclose(statistics.sums, [9.0, 7.0, 2.5])
+
+    def test_statistics_are_recomputed_after_an_update_in_place(self):
+        dao.get_movie_rating_statistics()
+
+        # user 3 re-rates movie 103, which leaves the document count and the highest _id as they were
+        self.db["ratings"].update_one({"userId": 3, "movieId": 103}, {"$set": {"rating": 4.5, dao.UPDATE_MARKER_FIELD: 1}})
+        np.testing.assert_allclose(dao.get_movie_rating_statistics().sums, [9.0, 3.0, 4.5])
+
+        self.db["ratings"].update_one({"userId": 3, "movieId": 103}, {"$set": {"rating": 1.0, dao.UPDATE_MARKER_FIELD: 2}})
+        np.testing.assert_allclose(dao.get_movie_rating_statistics().sums, [9.0, 3.0, 1.0])
+
+    def test_empty_collections(self):
+        self.db["ratings"].delete_many({})
+        self.db["movies"].delete_many({})
+
+        self.assertEqual(len(dao.get_user_rating_statistics().ids), 0)
+        self.assertEqual(dao.get_genre_vocabulary()[0], [])
@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+import pandas as pd
+from recommendations.id_encoding import IdEncoder
+
+class TestIdEncoder(unittest.TestCase):
+
+    def test_fit_assigns_contiguous_positions_in_id_order(self):
+        # repeated ids (e.g. the userId of every rating) map to a single position each
+        encoder = IdEncoder.fit([30, 10, 20, 10, 30])
+
+        self.assertEqual(len(encoder), 3)
+        self.assertEqual(encoder.encode(10), 0)
+        self.assertEqual(encoder.encode(20), 1)
+        self.assertEqual(encoder.encode(30), 2)
+
+    def test_encode_unknown_id(self):
+        encoder = IdEncoder.fit([1, 2, 3])
+
+        self.assertEqual(encoder.encode(4), -1)
+        self.assertEqual(encoder.encode(0), -1)
+        self.assertEqual(encoder.encode("invalid id"), -1)
+        self.assertNotIn(4, encoder)
+        self.assertIn(2, encoder)
+
+    def test_encode_with_empty_encoder(self):
+        encoder = IdEncoder.fit([])
+
+        self.assertEqual(encoder.encode(1), -1)
+        self.assertEqual(encoder.encode_many([1, 2]).tolist(), [-1, -1])
+
+    def test_encode_many(self):
+        encoder = IdEncoder.fit([5, 1, 3])
+
+        positions = encoder.encode_many([3, 7, 1, 5])
+
+        self.assertEqual(positions.dtype, np.int32)
+        self.assertEqual(positions.tolist(), [1, -1, 0, 2]) # 7 is unknown so is encoded as -1
+
+    def test_decode_returns_plain_python_ids(self):
+        encoder = IdEncoder.fit(np.array([101, 102, 103], dtype=np.int64))
+
+        result = encoder.decode(np.array([2, 0], dtype=np.int32))
+
+        self.assertEqual(result, [103, 101])
+        self.assertIsInstance(result[0], int)
+
+    def test_from_unsorted_index_keeps_index_positions(self):
+        # positions must line up with the rows of the frame the index came from, even if the index is not sorted
+        encoder = IdEncoder.from_index(pd.Index([3, 1, 2]))
+
+        self.assertEqual(encoder.encode(3), 0)
+        self.assertEqual(encoder.encode(1), 1)
+        self.assertEqual(encoder.encode(2), 2)
+        self.assertEqual(encoder.encode_many([2, 3, 4]).tolist(), [2, 0, -1])
+        self.assertEqual(encoder.decode([0, 1, 2]), [3, 1, 2])
@@ -0,0 +1,204 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import numpy as np
+from scipy import sparse
+from recommendations import model_manager, movie_recommendations, similarity
+
+class TestModelManager(unittest.TestCase):
+
+    def setUp(self):
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.changeSource = model_manager.EventLogChangeSource(os.path.join(self.temporaryDirectory.name, "ratings.jsonl"))
+
+    def tearDown(self):
+        self.temporaryDirectory.cleanup()
+
+    def test_event_log_only_reads_complete_lines(self):
+        self.changeSource.append([{"userId": 1, "movieId": 101, "rating": 5.0}])
+        with open(self.changeSource.path, "a") as eventLog:
+            eventLog.write('{"userId": 2, "movieId"') # a rating still being written
+
+        self.assertEqual(self.changeSource.poll(), [{"userId": 1, "movieId": 101, "rating": 5.0}])
+        self.assertEqual(self.changeSource.poll(), [])
+
+        with open(self.changeSource.path, "a") as eventLog:
+            eventLog.write(': 102, "rating": 4.0}\n')
+        self.assertEqual(self.changeSource.poll(), [{"userId": 2, "movieId": 102, "rating": 4.0}])
+
+    @patch("database.dao.get_ratings_changed_since")
+    def test_mongo_change_source_polls_from_high_water_mark(self, mock_get_ratings_changed_since):
+        changeSource = model_manager.MongoChangeSource()
+        mock_get_ratings_changed_since.return_value = [{"_id": 1, "userId": 1, "movieId": 101, "rating": 5}, {"_id": 2, "userId": 2, "movieId": 101, "rating": 3}]
+
+        self.assertEqual(changeSource.poll(), [{"userId": 1, "movieId": 101, "rating": 5}, {"userId": 2, "movieId": 101, "rating": 3}])
+        mock_get_ratings_changed_since.assert_called_with(None, "_id", 0)
+
+        mock_get_ratings_changed_since.return_value = []
+        self.assertEqual(changeSource.poll(), [])
+        mock_get_ratings_changed_since.assert_called_with(2, "_id", 0) # from the last rating seen
+        self.assertEqual(changeSource.highWaterMark, 2)
+
+    @patch("database.dao.get_ratings_data")
+    def test_first_model_matches_built_model(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+        self.changeSource.append(self.getMockRatingsData())
+        manager = model_manager.ModelManager(self.changeSource)
+
+        self.assertIsNone(manager.recommend(1, excludeAlreadyWatchedMovies=True))
+        self.assertIsNone(manager.staleness())
+        self.assertTrue(manager.refresh())
+
+        self.assertEqual(manager.version, 1)
+        self.assertLess(manager.staleness(), 60)
+        model = movie_recommendations.build_recommender_model()
+        for userId in model.userIds.decode(range(len(model.userIds))):
+            self.assertEqual(manager.recommend(userId, excludeAlreadyWatchedMovies=True), model.recommend(userId, True, n=10, numberOfSimilarUsers=5))
+
+        # a user the model does not know gets its popularity ranking
+        self.assertEqual(manager.recommend(999, excludeAlreadyWatchedMovies=True), model.popularity.recommend(10))
+
+        self.assertFalse(manager.refresh()) # nothing changed
+        self.assertEqual(manager.version, 1)
+
+    def test_incremental_update_matches_full_rebuild(self):
+        for metric in ("cosine", "pearson", "jaccard"):
+            with self.subTest(metric=metric):
+                changeSource = model_manager.EventLogChangeSource(os.path.join(self.temporaryDirectory.name, metric + ".jsonl"))
+                changeSource.append(self.getMockRatingsData())
+                manager = model_manager.ModelManager(changeSource, numberOfNeighbours=4, metric=metric)
+                manager.refresh()
+                oldVersion = manager.current()
+                oldRatings = oldVersion.model.ratings.copy()
+
+                # existing users re-rate and rate movies, so only the neighbour lists that can change are recomputed
+                changeSource.append([{"userId": 3, "movieId": 104, "rating": 5.0}, {"userId": 3, "movieId": 101, "rating": 1.0}, {"userId": 17, "movieId": 110, "rating": 2.0}])
+                self.assertTrue(manager.refresh())
+
+                model = manager.model
+                self.assertEqual(manager.version, 2)
+                self.assertEqual(model.ratings[model.userIds.encode(3), model.movieIds.encode(101)], 1.0)
+                positions, scores = similarity.top_k_similar_users(sparse.csr_matrix(model.ratings), 4, metric=metric)
+                np.testing.assert_array_equal(model.neighbourPositions, positions)
+                np.testing.assert_allclose(model.neighbourScores, scores)
+                # the old model was never written to, requests still holding it see it exactly as it was
+                np.testing.assert_array_equal(oldVersion.model.ratings, oldRatings)
+                self.assertEqual(oldVersion.version, 1)
+
+    @patch("recommendations.movie_recommendations._servedPopularity", None)
+    def test_swapped_in_models_publish_their_popularity_index(self):
+        self.changeSource.append(self.getMockRatingsData())
+        manager = model_manager.ModelManager(self.changeSource, publishPopularity=True)
+
+        for newUser in (None, 99):
+            if newUser is not None:
+                self.changeSource.append([{"userId": newUser, "movieId": 101, "rating": 5.0}])
+            manager.refresh()
+            knownUserIds, popularityIndex = movie_recommendations.get_served_popularity()
+            self.assertIs(popularityIndex, manager.model.popularity)
+            self.assertIs(knownUserIds, manager.model.userIds)
+        self.assertIn(99, knownUserIds)
+
+    def test_new_users_and_movies_rebuild_the_model(self):
+        self.changeSource.append(self.getMockRatingsData())
+        manager = model_manager.ModelManager(self.changeSource)
+        manager.refresh()
+
+        self.changeSource.append([{"userId": 99, "movieId": 101, "rating": 5.0}, {"userId": 99, "movieId": 200, "rating": 4.0}])
+        manager.refresh()
+
+        self.assertIn(99, manager.model.userIds)
+        self.assertIn(200, manager.model.movieIds)
+        self.assertEqual(manager.model.watched_movies(99), {101, 200})
+        self.assertIsNotNone(manager.recommend(99, excludeAlreadyWatchedMovies=True))
+
+    def test_model_does_not_depend_on_how_changes_are_split_across_polls(self):
+        # user 2 rates movie 102 twice and removes their rating of movie 101
+        changes = self.getMockRatingsData() + [{"userId": 2, "movieId": 102, "rating": 5.0}, {"userId": 2, "movieId": 102, "rating": 1.0}, {"userId": 2, "movieId": 101, "rating": 0.0}]
+        models = []
+        for name, splits in (("one_poll", [changes]), ("two_polls", [changes[:-3], changes[-3:]]), ("every_change", [[change] for change in changes])):
+            changeSource = model_manager.EventLogChangeSource(os.path.join(self.temporaryDirectory.name, name + ".jsonl"))
+            manager = model_manager.ModelManager(changeSource)
+            for split in splits:
+                changeSource.append(split)
+                manager.refresh()
+            models.append(manager.model)
+
+        self.assertEqual(models[0].ratings[models[0].userIds.encode(2), models[0].movieIds.encode_many([101, 102])].tolist(), [0.0, 1.0])
+        for model in models[1:]:
+            np.testing.assert_array_equal(model.userIds.ids, models[0].userIds.ids)
+            np.testing.assert_array_equal(model.movieIds.ids, models[0].movieIds.ids)
+            np.testing.assert_array_equal(model.ratings, models[0].ratings)
+            np.testing.assert_array_equal(model.neighbourPositions, models[0].neighbourPositions)
+            for userId in model.userIds.ids.tolist():
+                self.assertEqual(model.recommend(userId, True, n=10, numberOfSimilarUsers=5), models[0].recommend(userId, True, n=10, numberOfSimilarUsers=5))
+
+    def test_failed_refresh_keeps_serving_and_keeps_changes(self):
+        self.changeSource.append(self.getMockRatingsData())
+        manager = model_manager.ModelManager(self.changeSource)
+        manager.refresh()
+        self.changeSource.append([{"userId": 3, "movieId": 104, "rating": 5.0}])
+
+        with patch("recommendations.similarity.top_k_similar_users", side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                manager.refresh()
+        self.assertEqual(manager.version, 1)
+        self.assertEqual(len(manager.pendingChanges), 1)
+
+        self.assertTrue(manager.refresh()) # the change is not lost
+        self.assertEqual(manager.model.ratings[manager.model.userIds.encode(3), manager.model.movieIds.encode(104)], 5.0)
+        self.assertEqual(manager.pendingChanges, [])
+
+    def test_background_refresh_swaps_while_serving(self):
+        self.changeSource.append(self.getMockRatingsData())
+        manager = model_manager.ModelManager(self.changeSource, pollIntervalSeconds=0.01)
+        manager.start()
+        try:
+            results = {}
+            errors = []
+            stopReading = threading.Event()
+
+            # readers take one version per request, so each result must be exactly that version's recommendations
+            def read():
+                while not stopReading.is_set():
+                    try:
+                        current = manager.current()
+                        results.setdefault(current.version, set()).add(tuple(current.model.recommend(1, True, n=10, numberOfSimilarUsers=5) or ()))
+                    except Exception as error:
+                        errors.append(error)
+
+            readers = [threading.Thread(target=read) for _ in range(4)]
+            for reader in readers:
+                reader.start()
+            for movieId in range(101, 106):
+                self.changeSource.append([{"userId": 2, "movieId": movieId, "rating": 5.0}])
+                self.waitFor(lambda: manager.version >= movieId - 99)
+            stopReading.set()
+            for reader in readers:
+                reader.join()
+        finally:
+            manager.stop()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(manager.version, 6)
+        for version, recommendations in results.items():
+            self.assertEqual(len(recommendations), 1, "version " + str(version) + " gave different recommendations")
+
+    def waitFor(self, condition, timeoutSeconds=10):
+        deadline = time.time() + timeoutSeconds
+        while not condition():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.005)
+
+    def getMockRatingsData(self):
+        # 30 users with between 2 and 7 ratings each, across 15 movies
+        rng = np.random.default_rng(11)
+        ratings = []
+        for userId in range(1, 31):
+            movieIds = rng.choice(np.arange(101, 116), size=2 + userId % 6, replace=False)
+            for movieId in movieIds:
+                ratings.append({"userId": userId, "movieId": int(movieId), "rating": float(rng.integers(1, 6))})
+        return ratings
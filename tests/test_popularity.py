@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from database import dao
+from recommendations import movie_recommendations, popularity
+from recommendations.id_encoding import IdEncoder
+from recommendations.popularity import PopularityIndex, blend_with_popularity
+from recommendations.recommender_model import RecommenderModel
+
+class TestPopularity(unittest.TestCase):
+
+    def test_bayesian_average_ranking(self):
+        # movie 101 has two 5s, movie 102 has ten 4.5s, movie 103 has ten 3s and movie 104 has no ratings
+        index = PopularityIndex(IdEncoder.fit([101, 102, 103, 104]), counts=[2, 10, 10, 0], sums=[10, 45, 30, 0], priorStrength=5)
+
+        globalMean = 85 / 22
+        np.testing.assert_allclose(index.scores[:3], [(5 * globalMean + 10) / 7, (5 * globalMean + 45) / 15, (5 * globalMean + 30) / 15])
+        # the two 5s are pulled most towards the global mean, so the many 4.5s rank first, and the unrated movie is never ranked
+        self.assertEqual(index.recommend(10), [102, 101, 103])
+
+    def test_prior_strength_defaults_to_mean_ratings_per_movie(self):
+        index = PopularityIndex(IdEncoder.fit([101, 102]), counts=[1, 5], sums=[5, 15])
+
+        self.assertEqual(index.priorStrength, 3)
+        self.assertAlmostEqual(index.globalMean, 20 / 6)
+
+    def test_recommend_excludes_watched_movies(self):
+        index = PopularityIndex.from_ratings(IdEncoder.fit([101, 102, 103, 104, 105]), self.getMockRatings())
+        self.assertEqual(index.recommend(10), [101, 102, 103, 104, 105])
+
+        self.assertEqual(index.recommend(2, watchedMovieIds={101, 103}), [102, 104])
+        self.assertEqual(index.recommend(10, watchedMovieIds={101, 102, 103, 999}), [104, 105]) # unknown movieIds are ignored
+        watched = np.array([True, True, False, False, False])
+        self.assertEqual(index.recommend_positions(2, watched).tolist(), [2, 3])
+
+    def test_recommend_by_genre(self):
+        movieGenreMap = {101: "Action|Comedy", 102: "Drama", 103: "Comedy", 105: "Action", 999: "Action"}
+        index = PopularityIndex.from_ratings(IdEncoder.fit([101, 102, 103, 104, 105]), self.getMockRatings(), movieGenreMap)
+
+        self.assertEqual(index.recommend(10, genre="Comedy"), [101, 103])
+        self.assertEqual(index.recommend(10, watchedMovieIds={101}, genre="Action"), [105])
+        self.assertEqual(index.recommend(10, genre="Western"), [])
+
+    def test_blend_with_popularity(self):
+        index = PopularityIndex(IdEncoder.fit([101, 102]), counts=[4, 4], sums=[16, 8])
+        # both neighbours rated movie 101 a 2, only the first one rated movie 102, a 5
+        ratings = np.array([[3.0, 0.0], [2.0, 5.0], [2.0, 0.0]])
+        neighbourPositions, neighbourScores = np.array([1, 2]), np.array([0.6, 0.4])
+        scores = neighbourScores @ ratings[neighbourPositions]
+        # each movie's weighted sum is divided by the similarity of the neighbours who rated it, so movie 102's mean is 5, not 3
+        neighbourMeans = np.array([2.0, 5.0])
+
+        np.testing.assert_allclose(blend_with_popularity(scores, ratings, neighbourPositions, neighbourScores, 1, index), 0.2 * neighbourMeans + 0.8 * index.scores)
+        np.testing.assert_allclose(blend_with_popularity(scores, ratings, neighbourPositions, neighbourScores, 4, index), 0.8 * neighbourMeans + 0.2 * index.scores)
+        self.assertIs(blend_with_popularity(scores, ratings, neighbourPositions, neighbourScores, popularity.PARTIAL_HISTORY_RATINGS, index), scores)
+
+    def test_model_without_similar_users_falls_back_to_popularity(self):
+        ratings = np.array([[5.0, 0.0, 3.0]])
+        model = RecommenderModel(IdEncoder.fit([1]), IdEncoder.fit([101, 102, 103]), ratings, np.array([[1.0]]), popularity=PopularityIndex(IdEncoder.fit([101, 102, 103]), [1, 1, 1], [5, 4, 3]))
+
+        self.assertEqual(model.recommend(1, True, n=10, numberOfSimilarUsers=5), [102]) # 101 and 103 are watched
+        self.assertEqual(model.recommend(1, False, n=10, numberOfSimilarUsers=5), [101, 102, 103])
+
+    @patch("recommendations.movie_recommendations._servedPopularity", None)
+    @patch("database.dao.get_user_rating_statistics")
+    @patch("database.dao.get_movie_rating_statistics")
+    def test_popularity_index_from_database_statistics_is_only_rebuilt_when_refreshed(self, mock_get_movie_rating_statistics, mock_get_user_rating_statistics):
+        mock_get_movie_rating_statistics.return_value = dao.RatingStatistics(np.array([101, 102]), np.array([3, 10]), np.array([9.0, 45.0]))
+        mock_get_user_rating_statistics.return_value = dao.RatingStatistics(np.array([1, 2]), np.array([6, 7]), np.array([27.0, 27.0]))
+
+        # nothing has been published yet, so the index is built on first use
+        index = movie_recommendations.get_popularity_index()
+        self.assertEqual(index.recommend(10), [102, 101])
+        self.assertIn(2, movie_recommendations.get_served_popularity()[0])
+
+        # after that, requests only read the published index, even once the statistics changed
+        mock_get_movie_rating_statistics.return_value = dao.RatingStatistics(np.array([101, 102]), np.array([30, 10]), np.array([150.0, 45.0]))
+        self.assertIs(movie_recommendations.get_popularity_index(), index)
+        self.assertEqual(mock_get_movie_rating_statistics.call_count, 1)
+
+        movie_recommendations.refresh_popularity_index()
+        self.assertEqual(movie_recommendations.get_popularity_index().recommend(10), [101, 102])
+
+    def getMockRatings(self):
+        # 4 users x 5 movies, every movie's Bayesian average is lower than the one before it
+        return np.array([
+            [5.0, 5.0, 4.0, 3.0, 1.0],
+            [5.0, 4.0, 4.0, 0.0, 0.0],
+            [5.0, 5.0, 0.0, 3.0, 0.0],
+            [5.0, 0.0, 0.0, 0.0, 0.0],
+        ])
@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from recommendations import movie_recommendations, recommendation_store
+
+class TestRecommendationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temporaryDirectory.name, "store")
+
+    def tearDown(self):
+        self.temporaryDirectory.cleanup()
+
+    @patch("recommendations.movie_recommendations._servedPopularity", None)
+    @patch("database.dao.get_ratings_data")
+    def test_lookup_matches_generated_recommendations(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+        model = movie_recommendations.build_recommender_model()
+        movie_recommendations.publish_popularity_index(model.userIds, model.popularity)
+
+        self.assertFalse(recommendation_store.store_exists(self.directory))
+        recommendation_store.build_store(model, self.directory)
+        self.assertTrue(recommendation_store.store_exists(self.directory))
+
+        store = recommendation_store.RecommendationStore(self.directory)
+        for userId in model.userIds.decode(range(len(model.userIds))):
+            for exclude in (True, False):
+                self.assertEqual(store.lookup(userId, excludeAlreadyWatchedMovies=exclude), movie_recommendations.generate_recommendations(userId, exclude, None, None))
+
+    @patch("database.dao.get_ratings_data")
+    def test_lookup_with_scores(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = [
+            {"userId": 1, "movieId": 101, "rating": 5},
+            {"userId": 2, "movieId": 101, "rating": 5},
+            {"userId": 2, "movieId": 102, "rating": 4},
+            {"userId": 3, "movieId": 101, "rating": 2},
+            {"userId": 3, "movieId": 103, "rating": 4},
+        ]
+        recommendation_store.build_store(movie_recommendations.build_recommender_model(), self.directory)
+        store = recommendation_store.RecommendationStore(self.directory)
+
+        result = store.lookup_with_scores(1, excludeAlreadyWatchedMovies=True)
+
+        # see test_recommendations.py, user 2 is user 1's most similar user (cosine 0.780869) and user 3 the next (cosine 0.447214).
+        # User 1 has a single rating, so the weighted mean rating of the neighbours who rated each movie gets a weight of 1/5 and the
+        # popularity prior, which is the global mean 4 for all three movies here, gets 4/5. Movies 102 and 103 each have a single
+        # neighbour rating of 4, so both score 4 and are in movieId order
+        self.assertEqual([movieId for movieId, _ in result], [102, 103])
+        np.testing.assert_allclose([score for _, score in result], [4.0, 4.0], rtol=1e-5)
+        # movie 101's neighbour mean is below 4, as user 3 rated it 2, so it comes after them when already watched movies are kept
+        self.assertEqual(store.lookup(1, excludeAlreadyWatchedMovies=False), [102, 103, 101])
+        # user 4 is not in the store, so gets the popularity ranking (all tied at 4, so in movieId order)
+        self.assertIsNone(store.lookup_with_scores(4, excludeAlreadyWatchedMovies=True))
+        self.assertEqual(store.lookup(4, excludeAlreadyWatchedMovies=True), [101, 102, 103])
+
+    @patch("database.dao.get_ratings_data")
+    def test_refresh_only_recomputes_affected_users(self, mock_get_ratings_data):
+        ratings = self.getMockRatingsData()
+        mock_get_ratings_data.return_value = ratings
+        recommendation_store.build_store(movie_recommendations.build_recommender_model(), self.directory, numberOfSimilarUsers=2)
+
+        # nothing changed, so nothing is recomputed
+        self.assertEqual(recommendation_store.refresh_store(movie_recommendations.build_recommender_model(), self.directory), 0)
+
+        # a reader that has the store open during the refresh
+        openStore = recommendation_store.RecommendationStore(self.directory)
+        before = {userId: openStore.lookup_with_scores(userId, excludeAlreadyWatchedMovies=True) for userId in openStore.userIds.ids.tolist()}
+
+        # user 5 changes a rating
+        mock_get_ratings_data.return_value = [dict(rating, rating=1.0) if rating["userId"] == 5 else rating for rating in ratings]
+        model = movie_recommendations.build_recommender_model()
+        recomputed = recommendation_store.refresh_store(model, self.directory)
+
+        self.assertGreater(recomputed, 0)
+        self.assertLess(recomputed, len(model.userIds))
+        # the refresh is written as a new generation, so the open reader still sees the store exactly as it was
+        self.assertEqual({userId: openStore.lookup_with_scores(userId, excludeAlreadyWatchedMovies=True) for userId in before}, before)
+        # after the partial refresh every user's stored recommendations are the same as a full rebuild
+        store = recommendation_store.RecommendationStore(self.directory)
+        for userId in model.userIds.decode(range(len(model.userIds))):
+            for exclude in (True, False):
+                self.assertEqual(store.lookup(userId, excludeAlreadyWatchedMovies=exclude), model.recommend(userId, exclude, n=store.n, numberOfSimilarUsers=2))
+
+    @patch("database.dao.get_ratings_data")
+    def test_every_build_and_refresh_writes_a_new_generation(self, mock_get_ratings_data):
+        ratings = self.getMockRatingsData()
+        mock_get_ratings_data.return_value = ratings
+        recommendation_store.build_store(movie_recommendations.build_recommender_model(), self.directory)
+        self.assertEqual(recommendation_store.RecommendationStore(self.directory).generation, 1)
+
+        for generation, rating in ((2, 1.0), (3, 2.0)):
+            mock_get_ratings_data.return_value = [dict(change, rating=rating) if change["userId"] == 5 else change for change in ratings]
+            recommendation_store.refresh_store(movie_recommendations.build_recommender_model(), self.directory)
+            self.assertEqual(recommendation_store.RecommendationStore(self.directory).generation, generation)
+
+        # the previous generation is kept for stores opened before the last switch, older ones are removed
+        self.assertEqual(sorted(entry for entry in os.listdir(self.directory) if entry.startswith("generation_")), ["generation_2", "generation_3"])
+
+    @patch("database.dao.get_ratings_data")
+    def test_refresh_rebuilds_when_users_change(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+        recommendation_store.build_store(movie_recommendations.build_recommender_model(), self.directory)
+
+        mock_get_ratings_data.return_value = self.getMockRatingsData() + [{"userId": 99, "movieId": 101, "rating": 4.0}]
+        model = movie_recommendations.build_recommender_model()
+
+        self.assertEqual(recommendation_store.refresh_store(model, self.directory), len(model.userIds))
+        self.assertIsNotNone(recommendation_store.RecommendationStore(self.directory).lookup(99, excludeAlreadyWatchedMovies=True))
+
+    def test_rating_fingerprints(self):
+        ratings = np.array([[5.0, 0.0], [5.0, 0.0], [0.0, 5.0]])
+
+        fingerprints = recommendation_store.rating_fingerprints(ratings)
+
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+
+    def getMockRatingsData(self):
+        # 30 users with between 2 and 7 ratings each, across 15 movies
+        rng = np.random.default_rng(11)
+        ratings = []
+        for userId in range(1, 31):
+            movieIds = rng.choice(np.arange(101, 116), size=2 + userId % 6, replace=False)
+            for movieId in movieIds:
+                ratings.append({"userId": userId, "movieId": int(movieId), "rating": float(rng.integers(1, 6))})
+        return ratings
@@ -1,7 +1,11 @@
 import unittest
 from unittest.mock import patch
+import numpy as np
 import pandas as pd
+from database import dao
 from recommendations import movie_recommendations
+from recommendations.id_encoding import IdEncoder
+from recommendations.popularity import PopularityIndex
 
 class TestMovieRecommendations(unittest.TestCase):
 
@@ -40,10 +44,76 @@ class TestMovieRecommendations(unittest.TestCase):
         # User most similar to user Id 1 is user 2 (as they have both rated movie 101 highly as 5), more similar than user 3
         # because user 3 rated movie 101 2 (while user 1 rated it as 5). As a result, user 2's movies, that user 1 has not seen,
         # are rated higher than user 3's movies in regards to user 1's recommendations.
-        # The highest ranked recommendation will however be 101 because user 2 rated that as 5, as did user 1, and excludeAlreadyWatchedMovies flag is set to False
-        expected_recommendations = [101, 102, 103]
+        # User 1 has a single rating, so their scores are blended with the popularity prior (4 for every movie here) and the mean rating
+        # of the neighbours who rated each movie: 4 for 102 and 103, but below 4 for 101 because user 3 rated it 2, so 101 comes last
+        expected_recommendations = [102, 103, 101]
         self.assertEqual(recommendations, expected_recommendations)
 
+    @patch("database.dao.get_ratings_data")
+    def test_generate_recommendations_with_fewer_movies_and_similar_users(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+
+        user_item_matrix = movie_recommendations.build_user_item_matrix()
+        user_similarity = movie_recommendations.build_user_to_user_similarity_matrix(user_item_matrix)
+
+        # only the single most similar user to user 1 (user 2) is used, so only user 2's movies are recommended, 101 first as user 2 rated it 5
+        self.assertEqual(movie_recommendations.generate_recommendations(1, False, user_item_matrix, user_similarity, numberOfSimilarUsers=1), [101, 102])
+        # with every similar user, 101's neighbour mean drops below 102's (see above)
+        self.assertEqual(movie_recommendations.generate_recommendations(1, False, user_item_matrix, user_similarity, n=1), [102])
+
+    @patch("recommendations.movie_recommendations._servedPopularity", None)
+    @patch("database.dao.get_ratings_data")
+    def test_generate_recommendations_with_another_similarity_metric(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+
+        user_item_matrix = movie_recommendations.build_user_item_matrix()
+        movie_recommendations.publish_popularity_index(IdEncoder.from_index(user_item_matrix.index), movie_recommendations.build_popularity_index(user_item_matrix))
+        user_similarity = movie_recommendations.build_user_to_user_similarity_matrix(user_item_matrix, metric="jaccard")
+
+        # by jaccard similarity (movies both users rated / movies either user rated) user 1 is as similar to user 2 (1/2) as to user 3 (1/2)
+        self.assertEqual(user_similarity.loc[1, 2], 0.5)
+        self.assertEqual(user_similarity.loc[1, 3], 0.5)
+        # so user 2's and user 3's unwatched movies both score 4 * 1/2, and the tie is broken by movieId
+        recommendations = movie_recommendations.generate_recommendations(1, True, user_item_matrix=None, user_similarity=None, similarityMetric="jaccard")
+        self.assertEqual(recommendations, [102, 103])
+
+    @patch("database.dao.get_movie_rating_statistics")
+    @patch("database.dao.get_ratings_data")
+    def test_generate_recommendations_for_unknown_user(self, mock_get_ratings_data, mock_get_movie_rating_statistics):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+        user_item_matrix = movie_recommendations.build_user_item_matrix()
+
+        # user 4 has no ratings, so gets the most popular movies (by Bayesian average rating) and no similarity matrix is built for them.
+        # They come from the given user-item matrix, where every movie's Bayesian average is the global mean of 4, so in movieId order
+        with patch("recommendations.movie_recommendations.build_user_to_user_similarity_matrix") as mock_build_user_to_user_similarity_matrix:
+            recommendations = movie_recommendations.generate_recommendations(4, True, user_item_matrix, user_similarity=None)
+        mock_build_user_to_user_similarity_matrix.assert_not_called()
+        mock_get_movie_rating_statistics.assert_not_called() # nor are the database's statistics read
+        self.assertEqual(recommendations, [101, 102, 103])
+
+        # a popularity index that is passed in is used instead
+        popularityIndex = PopularityIndex.from_statistics(dao.RatingStatistics(np.array([101, 102, 103]), np.array([3, 1, 1]), np.array([12.0, 2.0, 5.0])))
+        self.assertEqual(movie_recommendations.generate_recommendations(4, True, user_item_matrix, None, popularityIndex=popularityIndex), [103, 101, 102])
+
+    @patch("recommendations.movie_recommendations._servedPopularity", None)
+    @patch("database.dao.get_movie_rating_statistics")
+    @patch("database.dao.get_user_rating_statistics")
+    def test_generate_recommendations_for_unknown_user_without_user_item_matrix(self, mock_get_user_rating_statistics, mock_get_movie_rating_statistics):
+        mock_get_user_rating_statistics.return_value = self.getMockUserRatingStatistics()
+        mock_get_movie_rating_statistics.return_value = dao.RatingStatistics(np.array([101, 102, 103]), np.array([3, 1, 1]), np.array([12.0, 2.0, 5.0]))
+        movie_recommendations.refresh_popularity_index() # off the request path
+        mock_get_user_rating_statistics.reset_mock()
+        mock_get_movie_rating_statistics.reset_mock()
+
+        # user 4 is not one of the published known users, so they get the published ranking without the user-item matrix being
+        # built or the database being read
+        with patch("recommendations.movie_recommendations.build_user_item_matrix") as mock_build_user_item_matrix:
+            recommendations = movie_recommendations.generate_recommendations(4, True, user_item_matrix=None, user_similarity=None)
+        mock_build_user_item_matrix.assert_not_called()
+        mock_get_user_rating_statistics.assert_not_called()
+        mock_get_movie_rating_statistics.assert_not_called()
+        self.assertEqual(recommendations, [103, 101, 102])
+
     @patch("database.dao.get_ratings_data") 
     def test_build_matrix_with_data(self, mock_get_ratings_data):
         mock_get_ratings_data.return_value = self.getMockRatingsData()
@@ -170,6 +240,10 @@ class TestMovieRecommendations(unittest.TestCase):
         # User with id 4 has the most similar user as user 3
         self.assertEqual(result, [(3, 0.9)])
 
+    def getMockUserRatingStatistics(self):
+        # the rating counts and sums of the users in getMockRatingsData
+        return dao.RatingStatistics(np.array([1, 2, 3]), np.array([1, 2, 2]), np.array([5.0, 9.0, 6.0]))
+
     def getMockRatingsData(self):
         return [
             {"userId": 1, "movieId": 101, "rating": 5},
@@ -0,0 +1,158 @@
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import numpy as np
+from recommendations import movie_recommendations
+from recommendations.id_encoding import IdEncoder
+from recommendations.recommender_model import RecommenderModel, top_similar_users
+
+class TestRecommenderModel(unittest.TestCase):
+
+    @patch("database.dao.get_ratings_data")
+    def test_model_recommendations_match_matrix_recommendations(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+
+        model = movie_recommendations.build_recommender_model()
+
+        # see test_recommendations.py. User 1 has a single rating, so their scores are blended with the popularity prior (4 for every
+        # movie here) and the mean rating of the neighbours who rated each movie: 4 for 102 and 103, but below 4 for 101, which user 3 rated 2
+        self.assertEqual(model.recommend(1, True, n=10, numberOfSimilarUsers=5), [102, 103])
+        self.assertEqual(model.recommend(1, False, n=10, numberOfSimilarUsers=5), [102, 103, 101])
+
+    @patch("database.dao.get_ratings_data")
+    def test_model_recommendations_for_unknown_user(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+
+        model = movie_recommendations.build_recommender_model()
+
+        # user 4 gets the popularity ranking, every movie's Bayesian average is the global mean of 4 here so they are in movieId order
+        self.assertEqual(model.recommend(4, True, n=10, numberOfSimilarUsers=5), [101, 102, 103])
+        model = RecommenderModel(model.userIds, model.movieIds, model.ratings, neighbourPositions=model.neighbourPositions, neighbourScores=model.neighbourScores)
+        self.assertIsNone(model.recommend(4, True, n=10, numberOfSimilarUsers=5)) # without a popularity index
+        self.assertEqual(model.most_similar_users(4, n=5), [])
+        self.assertEqual(model.watched_movies(4), set())
+
+    @patch("database.dao.get_ratings_data")
+    def test_model_most_similar_users_and_watched_movies(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+
+        model = movie_recommendations.build_recommender_model()
+
+        self.assertEqual([userId for userId, _ in model.most_similar_users(1, n=5)], [2, 3])
+        self.assertEqual(model.watched_movies(2), {101, 102})
+
+    def test_build_rating_arrays_averages_repeated_ratings(self):
+        ratings = self.getMockRatingsData() + [{"userId": 3, "movieId": 103, "rating": 2}] # user 3 rated movie 103 twice, 4 and 2
+
+        userIds, movieIds, ratings_array = movie_recommendations.build_rating_arrays(ratings)
+
+        self.assertEqual(userIds.decode(range(len(userIds))), [1, 2, 3])
+        self.assertEqual(movieIds.decode(range(len(movieIds))), [101, 102, 103])
+        np.testing.assert_array_equal(ratings_array, [
+            [5.0, 0.0, 0.0],
+            [5.0, 4.0, 0.0],
+            [2.0, 0.0, 3.0]
+        ])
+
+    @patch("database.dao.get_ratings_data")
+    def test_model_with_memory_mapped_similarity(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+
+        with tempfile.TemporaryDirectory() as directory:
+            model = movie_recommendations.build_recommender_model(similarityPath=os.path.join(directory, "similarity.npy"), dtype=np.float32)
+
+            self.assertIsNone(model.neighbourPositions)
+            self.assertEqual(model.recommend(1, True, n=10, numberOfSimilarUsers=5), [102, 103])
+            del model
+
+    @patch("database.dao.get_ratings_data")
+    def test_model_neighbour_table_is_used_instead_of_full_similarity(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = self.getMockRatingsData()
+
+        model = movie_recommendations.build_recommender_model(numberOfNeighbours=1)
+
+        self.assertIsNone(model.similarity)
+        self.assertEqual(model.neighbourPositions.shape, (3, 1))
+        # only user 1's single most similar user (user 2) is kept, so only user 2's unwatched movie is recommended
+        self.assertEqual(model.recommend(1, True, n=10, numberOfSimilarUsers=5), [102])
+
+    def test_top_similar_users_excludes_the_user_themselves(self):
+        similarity_row = np.array([0.9, 1.0, 0.7, 0.9])
+
+        positions, scores = top_similar_users(similarity_row, 1, n=5)
+
+        # position 1 is the user themselves, ties (positions 0 and 3) are broken by position
+        self.assertEqual(positions.tolist(), [0, 3, 2])
+        self.assertEqual(scores.tolist(), [0.9, 0.9, 0.7])
+        self.assertEqual(similarity_row[1], 1.0) # the model's similarity row is never written to
+
+    def test_recommend_with_no_other_users(self):
+        model = RecommenderModel(IdEncoder.fit([1]), IdEncoder.fit([101]), np.array([[5.0]]), np.array([[1.0]]))
+
+        self.assertIsNone(model.recommend(1, False, n=10, numberOfSimilarUsers=5))
+
+    def test_model_is_read_only(self):
+        ratings = np.array([[5.0, 0.0], [4.0, 3.0]])
+        model = RecommenderModel(IdEncoder.fit([1, 2]), IdEncoder.fit([101, 102]), ratings, np.array([[1.0, 0.8], [0.8, 1.0]]))
+
+        with self.assertRaises(ValueError):
+            model.ratings[0, 1] = 5.0
+        with self.assertRaises(ValueError):
+            model.similarity[0, 1] = 1.0
+        with self.assertRaises(ValueError):
+            model.userIds.ids[0] = 3
+        with self.assertRaises(AttributeError):
+            model.ratings = np.zeros((2, 2))
+        self.assertTrue(ratings.flags.writeable) # the model holds a read-only view, the array it was built from is left as it is
+
+        # including when the model is sent to another process
+        unpickled = pickle.loads(pickle.dumps(model))
+        self.assertFalse(unpickled.ratings.flags.writeable)
+        self.assertFalse(unpickled.userIds.ids.flags.writeable)
+        self.assertEqual(unpickled.recommend(1, True, n=10, numberOfSimilarUsers=1), [102])
+
+    @patch("database.dao.get_ratings_data")
+    def test_concurrent_recommendations_are_deterministic(self, mock_get_ratings_data):
+        # 200 users with between 1 and 30 ratings of 300 movies, so some users get blended scores and some only neighbour scores
+        rng = np.random.default_rng(3)
+        mock_get_ratings_data.return_value = [
+            {"userId": userId, "movieId": int(movieId), "rating": float(rng.integers(1, 11)) / 2}
+            for userId in range(1, 201) for movieId in rng.choice(300, size=rng.integers(1, 31), replace=False)
+        ]
+        model = movie_recommendations.build_recommender_model(numberOfNeighbours=20)
+        requests = [(userId, exclude, numberOfSimilarUsers) for userId in range(0, 203) for exclude in (True, False) for numberOfSimilarUsers in (5, 20)]
+        expected = {request: model.recommend(request[0], request[1], n=10, numberOfSimilarUsers=request[2]) for request in requests}
+
+        # every thread serves every request in its own order, all starting together and switching as often as possible
+        threads = 8
+        startTogether = threading.Barrier(threads)
+        def serve(seed):
+            order = np.random.default_rng(seed).permutation(len(requests))
+            startTogether.wait()
+            return [(requests[i], model.recommend(requests[i][0], requests[i][1], n=10, numberOfSimilarUsers=requests[i][2])) for i in order]
+
+        switchInterval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                results = list(pool.map(serve, range(threads)))
+        finally:
+            sys.setswitchinterval(switchInterval)
+
+        for threadResults in results:
+            for request, recommendations in threadResults:
+                self.assertEqual(recommendations, expected[request], request)
+
+    def getMockRatingsData(self):
+        return [
+            {"userId": 1, "movieId": 101, "rating": 5},
+            {"userId": 2, "movieId": 101, "rating": 5},
+            {"userId": 2, "movieId": 102, "rating": 4},
+            {"userId": 3, "movieId": 101, "rating": 2},
+            {"userId": 3, "movieId": 103, "rating": 4},
+        ]
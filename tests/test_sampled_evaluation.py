@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from tests import mock_data
+from evaluator import evaluator, sampled_evaluation
+from recommendations.id_encoding import IdEncoder
+from recommendations.popularity import PopularityIndex
+
+class TestSampledEvaluation(unittest.TestCase):
+
+    @patch("database.dao.build_movie_genre_map")
+    @patch("database.dao.get_ratings_data")
+    def test_sample_of_every_user_matches_full_evaluation(self, mock_get_ratings_data, mock_build_movie_genre_map):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        mock_build_movie_genre_map.return_value = mock_data.get_mock_movie_genre_map()
+
+        results = sampled_evaluation.evaluate_sampled(sampleSize=1000, numberOfBootstrapSamples=200)
+
+        # when every user is sampled, the estimates are the same numbers evaluator.evaluate prints
+        recommendationsForHitRate = evaluator.generate_recommendations_for_all_users(excludeAlreadyWatchedMovies=False)
+        recommendations = evaluator.generate_recommendations_for_all_users(excludeAlreadyWatchedMovies=True)
+        LOOCVTestData = evaluator.generateLOOCVTestData()
+        self.assertAlmostEqual(results.loc["Hit rate", "estimate"], evaluator.calculateHitRate(recommendationsForHitRate, LOOCVTestData))
+        self.assertAlmostEqual(results.loc["Average Reciprocal Hit rate", "estimate"], evaluator.calculateAverageReciprocalHitRate(recommendationsForHitRate, LOOCVTestData))
+        self.assertAlmostEqual(results.loc["Coverage", "estimate"], evaluator.calculateCoverage(recommendations))
+        self.assertAlmostEqual(results.loc["Diversity", "estimate"], evaluator.calculateAverageGiniSimpsonDiversityAcrossAllUsers(recommendations, mock_data.get_mock_movie_genre_map()))
+        self.assertAlmostEqual(results.loc["Novelty", "estimate"], evaluator.calculateAverageNoveltyAcrossAllUsers(recommendations))
+
+        for metric, row in results.iterrows():
+            self.assertLessEqual(row["lower"], row["upper"])
+
+    @patch("database.dao.build_movie_genre_map")
+    @patch("database.dao.get_ratings_data")
+    def test_sampled_evaluation_is_reproducible_with_a_seed(self, mock_get_ratings_data, mock_build_movie_genre_map):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        mock_build_movie_genre_map.return_value = mock_data.get_mock_movie_genre_map()
+
+        first = sampled_evaluation.evaluate_sampled(sampleSize=6, seed=3, numberOfBootstrapSamples=100)
+        second = sampled_evaluation.evaluate_sampled(sampleSize=6, seed=3, numberOfBootstrapSamples=100)
+
+        self.assertTrue(first.equals(second))
+
+    @patch("database.dao.build_movie_genre_map")
+    @patch("database.dao.get_ratings_data")
+    def test_sample_grows_until_intervals_are_narrow_enough(self, mock_get_ratings_data, mock_build_movie_genre_map):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        mock_build_movie_genre_map.return_value = mock_data.get_mock_movie_genre_map()
+
+        # a target width of 0 can never be met on a sample, so users are added until every user has been sampled
+        with patch("evaluator.sampled_evaluation.score_sampled_users", wraps=sampled_evaluation.score_sampled_users) as mock_score_sampled_users:
+            sampled_evaluation.evaluate_sampled(sampleSize=4, numberOfBootstrapSamples=100, targetIntervalWidth=0.0)
+
+        scoredUsers = np.concatenate([call.args[1] for call in mock_score_sampled_users.call_args_list])
+        self.assertEqual(mock_score_sampled_users.call_count, 3) # 4, then 8, then all 12 users
+        self.assertEqual(sorted(scoredUsers.tolist()), list(range(12))) # each user is only scored once
+
+    def test_stratified_sample_is_proportional_to_strata_sizes(self):
+        strata = np.array([0, 0, 0, 0, 0, 0, 1, 1, 1, 2, 2, 2])
+        sampleOrder = sampled_evaluation.stratified_sample_order(strata, np.random.default_rng(1))
+
+        sample = sampled_evaluation.stratified_sample(sampleOrder, strata, 4)
+        largerSample = sampled_evaluation.stratified_sample(sampleOrder, strata, 8)
+
+        self.assertEqual(np.bincount(strata[sample]).tolist(), [2, 1, 1]) # half of the users are in stratum 0
+        self.assertTrue(set(sample.tolist()).issubset(set(largerSample.tolist())))
+
+    def test_activity_strata(self):
+        ratingsArray = np.array([
+            [5.0, 0.0, 0.0, 0.0],
+            [5.0, 4.0, 0.0, 0.0],
+            [5.0, 4.0, 3.0, 0.0],
+            [5.0, 4.0, 3.0, 2.0],
+        ])
+
+        self.assertEqual(sampled_evaluation.activity_strata(ratingsArray, 2).tolist(), [0, 0, 1, 1])
+
+    def test_user_without_similar_users_gets_the_popularity_ranking(self):
+        # a single user has no similar users, so is recommended the popularity ranking, as RecommenderModel.recommend would
+        ratingsArray = np.array([[5.0, 0.0, 3.0, 0.0]])
+        movieIds = IdEncoder.fit([101, 102, 103, 104])
+        popularity = PopularityIndex(movieIds, counts=[1, 4, 1, 2], sums=[5.0, 18.0, 3.0, 4.0])
+
+        userMetrics = sampled_evaluation.score_sampled_users(ratingsArray, np.array([0]), np.array([2]), {}, popularity=popularity)
+
+        hit, _, recommended, _ = userMetrics[0]
+        self.assertEqual(recommended.tolist(), popularity.recommend_positions(10, ratingsArray[0] > 0).tolist())
+        self.assertEqual(hit, 1.0) # the left-out movie 103 is in the ranking, watched movies included
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from recommendations import similarity
+
+class TestSimilarity(unittest.TestCase):
+
+    def test_blocked_cosine_similarity_matches_sklearn(self):
+        ratings = self.getRatings()
+
+        # a budget of one row of scores forces every user into their own block
+        result = similarity.similarity_matrix(ratings, memoryBudgetBytes=ratings.shape[0] * 8)
+
+        np.testing.assert_allclose(result, cosine_similarity(ratings), atol=1e-12)
+
+    def test_blocks_cover_every_user_within_the_budget(self):
+        ratings = self.getRatings()
+
+        blocks = [(start, stop, block.shape) for start, stop, block in similarity.iter_similarity_blocks(ratings, memoryBudgetBytes=2 * ratings.shape[0] * 8)]
+
+        self.assertEqual(blocks, [(0, 2, (2, 5)), (2, 4, (2, 5)), (4, 5, (1, 5))])
+
+    def test_float32_similarity(self):
+        ratings = self.getRatings()
+
+        result = similarity.similarity_matrix(ratings, dtype=np.float32)
+
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_allclose(result, cosine_similarity(ratings), atol=1e-6)
+
+    def test_user_with_no_ratings_has_zero_similarity(self):
+        ratings = np.array([[5.0, 3.0], [0.0, 0.0]])
+
+        result = similarity.similarity_matrix(ratings)
+
+        np.testing.assert_array_equal(result[1], [0.0, 0.0])
+
+    def test_similarity_memmap(self):
+        ratings = self.getRatings()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "similarity.npy")
+            result = similarity.similarity_memmap(ratings, path, memoryBudgetBytes=ratings.shape[0] * 8)
+
+            self.assertIsInstance(result, np.memmap)
+            self.assertFalse(result.flags.writeable)
+            np.testing.assert_allclose(result, cosine_similarity(ratings), atol=1e-12)
+            del result
+
+    def test_top_k_similar_users(self):
+        ratings = self.getRatings()
+
+        positions, scores = similarity.top_k_similar_users(ratings, k=2, memoryBudgetBytes=ratings.shape[0] * 8)
+
+        # compare with sorting each row of the full matrix, skipping the user themselves
+        full = cosine_similarity(ratings)
+        for user in range(len(ratings)):
+            expected = [other for other in np.argsort(-full[user], kind="stable") if other != user][:2]
+            self.assertEqual(positions[user].tolist(), expected)
+            np.testing.assert_allclose(scores[user], full[user, expected], atol=1e-12)
+
+    def test_top_k_similar_users_with_k_larger_than_number_of_users(self):
+        positions, scores = similarity.top_k_similar_users(self.getRatings(), k=10)
+
+        self.assertEqual(positions.shape, (5, 4)) # every other user is kept, but never the user themselves
+        for user in range(5):
+            self.assertNotIn(user, positions[user].tolist())
+
+    def test_top_k_similar_users_for_a_subset_of_users(self):
+        ratings = self.getRatings()
+
+        positions, scores = similarity.top_k_similar_users(ratings, k=2, userPositions=np.array([3, 0]))
+        allPositions, allScores = similarity.top_k_similar_users(ratings, k=2)
+
+        # only the requested users' rows are computed, in the requested order
+        np.testing.assert_array_equal(positions, allPositions[[3, 0]])
+        np.testing.assert_allclose(scores, allScores[[3, 0]])
+
+    def getRatings(self):
+        return np.array([
+            [5.0, 0.0, 3.0, 0.0],
+            [4.0, 1.0, 0.0, 0.0],
+            [0.0, 5.0, 0.0, 2.0],
+            [5.0, 0.0, 2.5, 0.5],
+            [0.0, 0.0, 4.0, 4.0],
+        ])
@@ -0,0 +1,115 @@
+import unittest
+import numpy as np
+from scipy import sparse
+from recommendations import similarity
+from recommendations.similarity_metrics import ShrunkCosineSimilarity, create_similarity_metric
+
+class TestSimilarityMetrics(unittest.TestCase):
+
+    def test_metrics_match_reference_definitions(self):
+        ratings = self.getRatings()
+
+        for metric, reference in (
+            ("cosine", self.referenceCosine),
+            ("pearson", self.referencePearson),
+            ("adjusted_cosine", self.referenceAdjustedCosine),
+            ("jaccard", self.referenceJaccard),
+            ("shrunk_cosine", lambda ratings: self.referenceCosine(ratings) * self.coRated(ratings) / (self.coRated(ratings) + 100)),
+        ):
+            # a budget of a single row forces one block per user, to check blocks are stitched together correctly
+            result = similarity.similarity_matrix(sparse.csr_matrix(ratings), memoryBudgetBytes=1, metric=metric)
+            np.testing.assert_allclose(result, reference(ratings), atol=1e-9, err_msg=metric)
+
+    def test_sparse_and_dense_ratings_give_the_same_similarity(self):
+        ratings = self.getRatings()
+
+        for metric in ("cosine", "pearson", "adjusted_cosine", "jaccard", "shrunk_cosine"):
+            np.testing.assert_allclose(
+                similarity.similarity_matrix(sparse.csr_matrix(ratings), metric=metric),
+                similarity.similarity_matrix(ratings, metric=metric),
+                atol=1e-12,
+                err_msg=metric
+            )
+
+    def test_float32_metrics(self):
+        ratings = self.getRatings()
+
+        for metric in ("pearson", "adjusted_cosine", "jaccard"):
+            result = similarity.similarity_matrix(sparse.csr_matrix(ratings), dtype=np.float32, metric=metric)
+            self.assertEqual(result.dtype, np.float32)
+            np.testing.assert_allclose(result, similarity.similarity_matrix(ratings, metric=metric), atol=1e-5, err_msg=metric)
+
+    def test_top_k_similar_users_with_another_metric(self):
+        ratings = self.getRatings()
+
+        positions, _ = similarity.top_k_similar_users(sparse.csr_matrix(ratings), k=2, metric="jaccard")
+
+        full = self.referenceJaccard(ratings)
+        for user in range(len(ratings)):
+            expected = [other for other in np.argsort(-full[user], kind="stable") if other != user][:2]
+            self.assertEqual(positions[user].tolist(), expected)
+
+    def test_custom_metric(self):
+        ratings = self.getRatings()
+
+        result = similarity.similarity_matrix(ratings, metric=lambda ratings, dtype: ShrunkCosineSimilarity(ratings, dtype, shrinkage=1))
+
+        np.testing.assert_allclose(result, self.referenceCosine(ratings) * self.coRated(ratings) / (self.coRated(ratings) + 1), atol=1e-12)
+
+    def test_custom_metric_with_only_a_block_method(self):
+        ratings = self.getRatings()
+
+        # the documented contract is just block(rows), numberOfUsers and temporariesPerRow are optional
+        class DotProduct:
+            def __init__(self, ratings, dtype):
+                self.ratings = np.asarray(ratings, dtype=dtype)
+
+            def block(self, rows):
+                return self.ratings[rows] @ self.ratings.T
+
+        result = similarity.similarity_matrix(ratings, memoryBudgetBytes=3 * 10 * 8, metric=DotProduct)
+
+        np.testing.assert_allclose(result, ratings @ ratings.T)
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            create_similarity_metric("euclidean", self.getRatings())
+
+    def getRatings(self):
+        # 8 users x 12 movies, roughly 40% rated, plus a user with no ratings and a user who gives every movie the same rating
+        rng = np.random.default_rng(3)
+        ratings = np.where(rng.random((8, 12)) < 0.4, rng.integers(1, 11, (8, 12)) / 2, 0.0)
+        ratings[6] = 0.0
+        ratings[7] = np.where(ratings[7] > 0, 3.0, 0.0)
+        return ratings
+
+    # reference implementations, written directly from each metric's definition one pair of users at a time
+
+    def referenceCosine(self, ratings):
+        return self.pairwise(ratings, lambda x, y: x @ y / (np.linalg.norm(x) * np.linalg.norm(y)) if x.any() and y.any() else 0.0)
+
+    def referencePearson(self, ratings):
+        def pearson(x, y):
+            coRated = (x > 0) & (y > 0)
+            if coRated.sum() < 2:
+                return 0.0
+            x, y = x[coRated] - x[coRated].mean(), y[coRated] - y[coRated].mean()
+            denominator = np.sqrt((x @ x) * (y @ y))
+            return x @ y / denominator if denominator > 1e-9 else 0.0
+        return self.pairwise(ratings, pearson)
+
+    def referenceAdjustedCosine(self, ratings):
+        rated = ratings > 0
+        movieMeans = np.divide(ratings.sum(axis=0), rated.sum(axis=0), out=np.zeros(ratings.shape[1]), where=rated.any(axis=0))
+        centred = np.where(rated, ratings - movieMeans, 0.0)
+        return self.pairwise(centred, lambda x, y: x @ y / (np.linalg.norm(x) * np.linalg.norm(y)) if np.linalg.norm(x) > 1e-9 and np.linalg.norm(y) > 1e-9 else 0.0)
+
+    def referenceJaccard(self, ratings):
+        return self.pairwise(ratings, lambda x, y: ((x > 0) & (y > 0)).sum() / ((x > 0) | (y > 0)).sum() if ((x > 0) | (y > 0)).any() else 0.0)
+
+    def coRated(self, ratings):
+        rated = (ratings > 0).astype(float)
+        return rated @ rated.T
+
+    def pairwise(self, ratings, function):
+        return np.array([[function(x, y) for y in ratings] for x in ratings])
@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from tests import mock_data
+from evaluator import cutoff_metrics, sweep
+from recommendations import movie_recommendations
+
+class TestSweep(unittest.TestCase):
+
+    @patch("database.dao.build_movie_genre_map")
+    @patch("database.dao.get_ratings_data")
+    def test_sweep_matches_evaluating_each_configuration(self, mock_get_ratings_data, mock_build_movie_genre_map):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        mock_build_movie_genre_map.return_value = mock_data.get_mock_movie_genre_map()
+
+        results = sweep.run_sweep(neighbourCounts=(2, 5), listLengths=(3, 5), excludeAlreadyWatchedMoviesOptions=(True,), processes=1)
+
+        self.assertEqual(len(results), 4) # 2 neighbour counts x 2 list lengths
+        for numberOfSimilarUsers in (2, 5):
+            expected = cutoff_metrics.evaluate_at_cutoffs(cutoffs=(3, 5), numberOfSimilarUsers=numberOfSimilarUsers)
+            for n in (3, 5):
+                np.testing.assert_allclose(results.loc[(numberOfSimilarUsers, n, True)].to_numpy(dtype=float), expected[n].to_numpy(dtype=float))
+
+    @patch("database.dao.build_movie_genre_map")
+    @patch("database.dao.get_ratings_data")
+    def test_sweep_builds_the_model_once(self, mock_get_ratings_data, mock_build_movie_genre_map):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        mock_build_movie_genre_map.return_value = mock_data.get_mock_movie_genre_map()
+
+        with patch("recommendations.movie_recommendations.build_recommender_model", wraps=movie_recommendations.build_recommender_model) as mock_build_recommender_model:
+            results = sweep.run_sweep(neighbourCounts=(1, 2, 3), listLengths=(2, 4), processes=1)
+
+        mock_build_recommender_model.assert_called_once_with(numberOfNeighbours=3, metric="cosine")
+        self.assertEqual(len(results), 12) # 3 neighbour counts x 2 list lengths x 2 exclude options
+        self.assertEqual(list(results.index.names), ["numberOfSimilarUsers", "n", "excludeAlreadyWatchedMovies"])
+
+    @patch("database.dao.get_ratings_data")
+    def test_parallel_scoring_matches_scoring_in_process(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        model = movie_recommendations.build_recommender_model(numberOfNeighbours=5)
+
+        inProcess = sweep.score_all_users(model, [2, 5], 4, processes=1)
+        parallel = sweep.score_all_users(model, [2, 5], 4, processes=2)
+
+        np.testing.assert_array_equal(inProcess[0], parallel[0])
+        np.testing.assert_array_equal(inProcess[1], parallel[1])
+
+    @patch("database.dao.get_ratings_data")
+    def test_neighbour_counts_share_one_scoring_pass(self, mock_get_ratings_data):
+        mock_get_ratings_data.return_value = mock_data.get_mock_ratings_data()
+        model = movie_recommendations.build_recommender_model(numberOfNeighbours=5)
+
+        rankedForHitRate, ranked = cutoff_metrics.ranked_tables_for_neighbour_counts(model, np.arange(12), [5, 2], 3)
+
+        # each neighbour count gives the same lists as generating recommendations with that many similar users
+        for countIndex, numberOfSimilarUsers in enumerate([5, 2]):
+            for userPosition, userId in enumerate(model.userIds.decode(range(12))):
+                expected = model.recommend(userId, True, n=3, numberOfSimilarUsers=numberOfSimilarUsers)
+                self.assertEqual(model.movieIds.decode(ranked[countIndex, userPosition][ranked[countIndex, userPosition] >= 0]), expected)